@@ -0,0 +1,187 @@
+"""
+Local control API on a Unix socket
+
+The control loop publishes what it has already computed to a StateCache, a read
+returns the latest published snapshot without any astro computation and without
+locking against the step path. Motion requests are put on a CommandQueue that the
+controller drains between moves.
+
+Protocol: one JSON object per line in each direction
+    {"cmd": "state"}                        -> {"ok": true, "state": {...}}
+    {"cmd": "goto", "ra": 123.4}            -> {"ok": true, "queued": 1}
+    {"cmd": "goto", "ra": 123.4, "dec": 5}
+    {"cmd": "home"} / {"cmd": "park"}       -> {"ok": true, "queued": 2}
+errors are answered with {"ok": false, "error": "..."}
+
+Client talks to the socket, LocalClient calls the same handler in process and
+stands in for it in tests and simulations.
+"""
+
+import os
+import json
+import math
+import queue
+import itertools
+import threading
+import socketserver
+from constants import *
+
+COMMANDS = ('goto', 'home', 'park')
+
+
+class StateCache:
+    """ latest state snapshot, replaced as a whole by publish so readers never see a partial update """
+
+    def __init__(self):
+        self.current = {'version': 0}
+
+    def publish(self, **fields):
+        self.current = {**self.current, **fields, 'version': self.current['version'] + 1}
+
+    def snapshot(self):
+        return self.current
+
+
+class CommandQueue:
+    """ thread safe queue of motion commands, each one gets an id """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.ids = itertools.count(1)
+
+    def put(self, name, **args):
+        commandId = next(self.ids)
+        self.queue.put((commandId, name, args))
+        return commandId
+
+    def get(self):
+        """ next (id, name, args) command, None if there is none """
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+
+def handle(request, state, commands):
+    """ answers one API request
+
+    Args:
+        request (dict): decoded request, anything else is answered with an error
+        state (StateCache): published state
+        commands (CommandQueue): queue for goto/home/park
+
+    Returns:
+        dict: the response
+    """
+    if not isinstance(request, dict):
+        return {'ok': False, 'error': 'request must be a JSON object'}
+    cmd = request.get('cmd')
+    if cmd == 'state':
+        return {'ok': True, 'state': state.snapshot()}
+    if cmd not in COMMANDS:
+        return {'ok': False, 'error': f'unknown command {cmd!r}'}
+    args = {}
+    if cmd == 'goto':
+        try:
+            ra = float(request['ra'])
+            dec = float(request['dec']) if request.get('dec') is not None else None
+        except (KeyError, TypeError, ValueError):
+            return {'ok': False, 'error': 'goto needs a numeric ra (and optionally dec) in degrees'}
+        # nan and inf pass float(), nothing is queued for them
+        if not math.isfinite(ra) or (dec is not None and not (math.isfinite(dec) and -90 <= dec <= 90)):
+            return {'ok': False, 'error': 'goto needs a finite ra and a dec between -90 and 90 degrees'}
+        args['ra'] = ra % 360
+        if dec is not None:
+            args['dec'] = dec
+    return {'ok': True, 'queued': commands.put(cmd, **args)}
+
+
+class ApiHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = handle(json.loads(line), self.server.state, self.server.commands)
+            except ValueError:
+                response = {'ok': False, 'error': 'request is not valid JSON'}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class ApiServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, state, commands):
+        self.state = state
+        self.commands = commands
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, ApiHandler)
+
+
+def serve(state, commands, path=API_SOCKET):
+    """ serves the API from a daemon thread
+
+    Returns:
+        ApiServer: the server, None if the socket could not be created
+    """
+    try:
+        server = ApiServer(path, state, commands)
+    except OSError as e:
+        print(f'control API not started: {e}')
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class LocalClient:
+    """ in-process client, calls the API handler directly """
+
+    def __init__(self, state, commands):
+        self.state = state
+        self.commands = commands
+
+    def request(self, **request):
+        return handle(request, self.state, self.commands)
+
+    def snapshot(self):
+        return self.request(cmd='state')['state']
+
+    def goto(self, ra, dec=None):
+        return self.request(cmd='goto', ra=ra, dec=dec)
+
+    def home(self):
+        return self.request(cmd='home')
+
+    def park(self):
+        return self.request(cmd='park')
+
+
+class Client(LocalClient):
+    """ client of the API socket """
+
+    def __init__(self, path=API_SOCKET):
+        import socket
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+
+    def request(self, **request):
+        self.file.write(json.dumps(request).encode() + b'\n')
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    import sys
+    client = Client()
+    if len(sys.argv) < 2 or sys.argv[1] == 'state':
+        print(json.dumps(client.snapshot(), indent=2))
+    elif sys.argv[1] == 'goto':
+        print(client.goto(*map(float, sys.argv[2:4])))
+    else:
+        print(client.request(cmd=sys.argv[1]))
+    client.close()
@@ -0,0 +1,67 @@
+"""
+States of the auto mode and the schedule decisions driving them
+
+master.trackSun runs the auto mode as a flat loop over these states, every pass
+does one transition and its action, so neither the stack nor the memory grow with
+the uptime:
+
+    IDLE    not running (before the start and after an interruption)
+    WAIT    sleeping until the next event of the schedule
+    SLEW    going to the sun at the start of the observing window
+    TRACK   tracking the sun until the window ends, a spectral overview is due or the sun sets
+    OVS     at zenith for a spectral overview slot
+    HOME    going home at the end of the observations or of an OVS slot
+    PARK    parking the antenna when the auto mode is stopped
+
+The scheduler decides the wanted activity (wanted()), the current state decides how
+to get there (nextState()).
+"""
+
+from scheduler import START, STOP, OVS_START, OVS_END, SUNRISE, SUNSET
+
+IDLE = 'IDLE'
+WAIT = 'WAIT'
+SLEW = 'SLEW'
+TRACK = 'TRACK'
+OVS = 'OVS'
+HOME = 'HOME'
+PARK = 'PARK'
+STATES = (IDLE, WAIT, SLEW, TRACK, OVS, HOME, PARK)
+
+# Events that can change the wanted activity, while waiting and while tracking
+WAKE_EVENTS = (START, OVS_START, SUNRISE)
+TRACK_END_EVENTS = (STOP, OVS_START, SUNSET)
+
+
+def wanted(schedule, timenow):
+    """ what the schedule asks for at timenow, the sun is up between the sunrise and sunset events
+
+    Args:
+        schedule (scheduler.Schedule): the observation schedule
+        timenow (datetime): timezone aware current time
+
+    Returns:
+        str: OVS, TRACK or WAIT
+    """
+    if schedule.inWindow(timenow, OVS_START, OVS_END):
+        return OVS
+    if schedule.inWindow(timenow, START, STOP) and schedule.inWindow(timenow, SUNRISE, SUNSET):
+        return TRACK
+    return WAIT
+
+
+def nextState(state, goal):
+    """ state the auto mode moves to from state on the way to goal (OVS, TRACK or WAIT)
+
+    Tracking starts with a slew, the antenna goes home whenever it leaves SLEW, TRACK or OVS
+    (and before an OVS, where gotoZenith starts from home)
+    """
+    if state == goal:
+        return state
+    if goal == TRACK and state == SLEW:
+        return TRACK
+    if state in (SLEW, TRACK, OVS) or (goal == OVS and state != HOME):
+        return HOME
+    if goal == TRACK:
+        return SLEW
+    return goal
@@ -0,0 +1,309 @@
+"""
+Benchmarks of the control loop against the simulated driver
+
+Reports the cold start time of the controller and for trackSun, goto, home and coords:
+    per-call latency percentiles
+    achieved steps per second (software time + modelled motion time + sleeps)
+    CPU time per simulated hour of tracking
+    pointing error of the antenna against the sun hour angle computed directly with PyEphem
+and the slew time and tracking error with the tracking steps at MICROSTEPS and at TRACK_MICROSTEPS.
+
+Time inside master.py runs on a clock.VirtualClock, so an hour of tracking takes seconds.
+Results are written as JSON, --compare checks them against an earlier run.
+
+usage: python benchmark.py [--date YYYY-MM-DD] [--output results.json] [--compare baseline.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import ephem
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+from datetime import datetime, timezone
+from constants import *
+from ephemeris import makeObserver, computeSun
+from position import raStepsToHourAngle
+from clock import VirtualClock
+from hardware import SimulatedTMC
+
+# Metrics where a larger value is better, everything else is compared as lower is better
+HIGHER_IS_BETTER = ('steps_per_s',)
+
+
+@contextlib.contextmanager
+def virtualClock(master, start):
+    """ runs master.py on a virtual clock starting at the unix timestamp start """
+    clock = VirtualClock(start)
+    previous = master.setClock(clock)
+    try:
+        yield clock
+    finally:
+        master.setClock(previous)
+
+
+def percentiles(samples):
+    """ latency summary in milliseconds """
+    samples = np.asarray(samples) * 1000
+    return {
+        'n': int(len(samples)),
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p90_ms': float(np.percentile(samples, 90)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'max_ms': float(samples.max()),
+    }
+
+
+class PointingTruth:
+    """ pointing error of the simulated antenna against PyEphem """
+
+    def __init__(self, master):
+        self.master = master
+        self.observer = makeObserver()
+        self.sun = ephem.Sun()
+
+    def antennaHourAngle(self):
+        return raStepsToHourAngle(self.master.absoluteStepperState[0])
+
+    def error(self, ts):
+        """ antenna minus sun hour angle in degrees """
+        sunHa = computeSun(self.observer, self.sun, ts).ha
+        return (self.antennaHourAngle() - sunHa + 180) % 360 - 180
+
+
+def meanAbsLinear(start, end):
+    """ mean of |e| over an interval in which e changes linearly from start to end """
+    if start * end >= 0:
+        return (abs(start) + abs(end)) / 2
+    # the error crosses zero, e.g. over a rate tracking step period from -0.5 to +0.5 steps
+    return (start * start + end * end) / (2 * (abs(start) + abs(end)))
+
+
+def benchCoords(master, n):
+    latencies = []
+    for _ in range(n):
+        t = time.perf_counter()
+        master.coords()
+        latencies.append(time.perf_counter() - t)
+    return {'latency': percentiles(latencies)}
+
+
+def benchHome(master, clock, distances):
+    tmc = master.tmc1
+    limitCounts = master.g.limits[LIMIT_PIN][1]
+    latencies = []
+    steps = 0
+    elapsed = 0.0
+    for distance in distances:
+        # distance steps at MICROSTEPS before the limit sensor
+        tmc.tmc.counts = limitCounts - distance * (SimulatedTMC.FULLSTEP_COUNTS // MICROSTEPS)
+        motion, slept = tmc.motionTime, clock.slept
+        t = time.perf_counter()
+        master.home()
+        wall = time.perf_counter() - t
+        latencies.append(wall)
+        steps += distance
+        elapsed += wall + tmc.motionTime - motion + clock.slept - slept
+    return {'latency': percentiles(latencies), 'steps_per_s': steps / elapsed}
+
+
+def benchGoto(master, clock, slews):
+    tmc = master.tmc1
+    latencies = []
+    steps = 0
+    elapsed = 0.0
+    for slew in slews:
+        target = (master.pointing[1] + slew) % 360
+        start, motion, slept = tmc.steps, tmc.motionTime, clock.slept
+        t = time.perf_counter()
+        master.goto(target, True)
+        wall = time.perf_counter() - t
+        latencies.append(wall)
+        steps += tmc.steps - start
+        elapsed += wall + tmc.motionTime - motion + clock.slept - slept
+    return {'latency': percentiles(latencies), 'steps_per_s': steps / elapsed}
+
+
+def benchTracking(master, clock, mode, duration):
+    """ tracks the sun for duration simulated seconds in the given TRACKING_MODE """
+    truth = PointingTruth(master)
+    tmc = master.tmc1
+    errors = []
+    weights = []
+    peaks = []
+    samplingCpu = [0.0]
+    latencies = []
+
+    def sample(now, seconds):
+        # the antenna is stationary while the loop sleeps, the error changes linearly over the sleep
+        t = time.process_time()
+        if seconds > 0:
+            start, end = truth.error(now), truth.error(now + seconds)
+            errors.append(meanAbsLinear(start, end))
+            weights.append(seconds)
+            peaks.append(max(abs(start), abs(end)))
+        samplingCpu[0] += time.process_time() - t
+
+    master.goto(master.sunEphemeris.at(clock.time()).ra, True)
+    startSteps = tmc.steps
+    startTransactions = tmc.transactions
+    clock.onSleep = sample
+    cpu = time.process_time()
+    end = clock.time() + duration
+    if mode == 'rate':
+        master.trackSunRate(datetime.fromtimestamp(end, timezone.utc))
+    else:
+        # holds the driver enabled like master.trackSun
+        with tmc.batch():
+            while clock.time() < end:
+                t = time.perf_counter()
+                master.trackSunOnce()
+                latencies.append(time.perf_counter() - t)
+                clock.sleep(1)
+    cpu = time.process_time() - cpu - samplingCpu[0]
+    clock.onSleep = None
+
+    errors = np.asarray(errors)
+    result = {
+        'cpu_s_per_hour': cpu * 3600 / duration,
+        'steps_per_hour': (tmc.steps - startSteps) * 3600 / duration,
+        'transactions_per_hour': (tmc.transactions - startTransactions) * 3600 / duration,
+        'mean_abs_error_deg': float(np.average(errors, weights=weights)) if len(errors) else None,
+        'max_abs_error_deg': max(peaks) if peaks else None,
+    }
+    if latencies:
+        result['latency'] = percentiles(latencies)
+    return result
+
+
+def benchMicrostepping(master, clock, duration):
+    """ half a turn slew from home and poll tracking with the tracking steps at MICROSTEPS and at TRACK_MICROSTEPS,
+    pulses are driver steps
+    """
+    tmc = master.tmc1
+    fine = master.TRACK_MICROSTEPS
+    results = {}
+    try:
+        for name, track in (('fixed', MICROSTEPS), ('fine_tracking', fine)):
+            master.TRACK_MICROSTEPS = track
+            master.home()
+            pulses, motion = tmc.steps, tmc.motionTime
+            master.moveRa(-STEPS_PER_ROT // 2)
+            result = {'slew_s': tmc.motionTime - motion, 'slew_pulses': tmc.steps - pulses}
+            master.home()
+            result.update(benchTracking(master, clock, 'poll', duration))
+            result.pop('latency')
+            results[name] = result
+    finally:
+        master.TRACK_MICROSTEPS = fine
+    return results
+
+
+def startupTime():
+    """ cold start of the controller in a fresh interpreter, as reported by master.init() """
+    code = 'import json, master; master.init("sim"); print(json.dumps(master.startupTimes))'
+    path = os.pathsep.join(filter(None, (os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH'))))
+    t = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=path)).stdout
+    wall = time.perf_counter() - t
+    result = {f'{phase}_s': value for phase, value in json.loads(output.splitlines()[-1]).items()}
+    result['process_s'] = wall
+    return result
+
+
+def run(date, duration, iterations):
+    import master
+    # the simulated controller writes its journal and telemetry into a scratch directory, not the station's
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix='ecallisto_bench_'))
+    try:
+        master.init('sim')
+
+        # local noon of the station, the sun is well above the horizon
+        start = datetime.strptime(date, '%Y-%m-%d').replace(hour=12, tzinfo=timezone.utc).timestamp() - LON / 15 * 3600
+        results = {
+            'meta': {
+                'date': date,
+                'run_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'tracking_duration_s': duration,
+            },
+        }
+        results['startup'] = startupTime()
+        with contextlib.redirect_stdout(io.StringIO()), virtualClock(master, start) as clock:
+            results['home'] = benchHome(master, clock, [100, 500, 1000])
+            results['goto'] = benchGoto(master, clock, [1, -1, 10, -10, 90, -90, 179, -179])
+            results['coords'] = benchCoords(master, iterations)
+            for mode in ('poll', 'rate'):
+                master.home()
+                results[f'trackSun_{mode}'] = benchTracking(master, clock, mode, duration)
+            results['microstepping'] = benchMicrostepping(master, clock, duration)
+        return results
+    finally:
+        os.chdir(cwd)
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if key == 'meta':
+            continue
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(results, baseline, threshold):
+    """ prints the change of every metric against baseline and returns the regressed ones """
+    current = flatten(results)
+    previous = flatten(baseline)
+    regressions = []
+    for key in sorted(current.keys() & previous.keys()):
+        if key.endswith('.n') or previous[key] == 0:
+            continue
+        change = (current[key] - previous[key]) / abs(previous[key])
+        worse = -change if key.split('.')[-1] in HIGHER_IS_BETTER else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print(f'{key:45s} {previous[key]:14.6g} -> {current[key]:14.6g} ({change:+.1%}){flag}')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--date', default='2025-06-21', help='simulated date (YYYY-MM-DD)')
+    parser.add_argument('--duration', type=float, default=3600, help='simulated seconds of tracking per mode')
+    parser.add_argument('--iterations', type=int, default=1000, help='calls for the latency benchmarks')
+    parser.add_argument('--output', default=None, help='JSON output path, defaults to benchmarks/<timestamp>.json')
+    parser.add_argument('--compare', default=None, help='earlier JSON result to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    results = run(args.date, args.duration, args.iterations)
+    output = args.output
+    if output is None:
+        os.makedirs('benchmarks', exist_ok=True)
+        output = os.path.join('benchmarks', datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f'results written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
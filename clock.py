@@ -0,0 +1,67 @@
+"""
+Clocks the control routines read the time from
+
+master.py never reads the time directly but through its clock (see master.setClock):
+    SystemClock     the wall clock, used on the station
+    VirtualClock    a simulated clock, sleep() advances it instantly (or at a chosen
+                    multiple of real time), used by simulate.py and benchmark.py
+
+Both have time() (unix timestamp), now(tz) (datetime) and sleep(seconds), so either
+can also be handed to planner.PlanExecutor.
+"""
+
+import time
+from datetime import datetime
+
+
+class ClockStopped(Exception):
+    """ raised by VirtualClock.sleep() once the end of the simulated interval is reached """
+
+
+class SystemClock:
+    """ the wall clock """
+
+    def time(self):
+        return time.time()
+
+    def now(self, tz=None):
+        return datetime.now(tz)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """ simulated clock starting at the unix timestamp start
+
+    Args:
+        start (float): unix timestamp the clock starts at
+        end (float): unix timestamp at which sleep() raises ClockStopped, None to run forever
+        speed (float): multiple of real time the clock runs at while sleeping, None to skip sleeps instantly
+    """
+
+    def __init__(self, start, end=None, speed=None):
+        self.current = start
+        self.end = end
+        self.speed = speed
+        self.slept = 0.0
+        # called as onSleep(now, seconds) before every sleep, e.g. to sample the pointing while the antenna stands still
+        self.onSleep = None
+
+    def time(self):
+        return self.current
+
+    def now(self, tz=None):
+        return datetime.fromtimestamp(self.current, tz)
+
+    def sleep(self, seconds):
+        if self.end is not None and self.current >= self.end:
+            raise ClockStopped(f'end of the simulation at {datetime.fromtimestamp(self.end)}')
+        if self.end is not None:
+            seconds = min(seconds, self.end - self.current)
+        if self.onSleep is not None:
+            self.onSleep(self.current, seconds)
+        if self.speed is not None:
+            time.sleep(seconds / self.speed)
+        self.current += seconds
+        self.slept += seconds
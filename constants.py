@@ -5,11 +5,25 @@ LAT = 45.276055
 LON = 13.721878
 ALTITUDE = 226
 
-# control pins
+# control pins, in BCM numbering like the TMC_2209 library uses
 enPin = 21
 dirPin = 20
 stepPin = 16
-limit = 17
+
+# RA limit sensor pin (BCM numbering), low while the sensor is triggered
+LIMIT_PIN = 17
+
+# Dec axis control pins
+decEnPin = 26
+decDirPin = 19
+decStepPin = 13
+
+# UART of the drivers, both TMC2209s share the serial port and are told apart by the
+# driver address set with their MS1/MS2 pins
+RA_UART_PORT = '/dev/serial0'
+RA_UART_ADDRESS = 0
+DEC_UART_PORT = '/dev/serial0'
+DEC_UART_ADDRESS = 1
 
 # microstepping
 MICROSTEPS = 2
@@ -20,22 +34,16 @@ STEPS_PER_ROT = 10000
 # Transmission ratio stepsperrev/200
 TRANSMISSION_RATIO = STEPS_PER_ROT / 200
 
-# Steps of the SM per 1 degree rotation on the output shaft
-STEPS_PER_DEG = int(STEPS_PER_ROT / 360)
+# Steps of the SM per 1 degree rotation on the output shaft (not a whole number, see position.py for the exact scale)
+STEPS_PER_DEG = STEPS_PER_ROT / 360
 
-# Inverse of the above, used to update the pointing after every step of a SM
-DEG_PER_STEP = 1/STEPS_PER_DEG
+# Inverse of the above, the angle of one step of a SM
+DEG_PER_STEP = 360 / STEPS_PER_ROT
 
 # Used to convert angles from radians to degrees
 RAD_TO_DEG_FACTOR = 180 / pi
 
-# Time in seconds that the program sleeps for after every step of a SM (no sleep time causes the motor to skip steps)
-SLEEP_TIME = 0.002
-
-# Rotation rate of the earth in degrees/second
-DEG_PER_SECOND = 1/240
-
-# Frequency (in seconds) of updating the position in console
+# Interval (in seconds) between telemetry records of the tracking state
 PRINT_FREQ = 5
 
 # Absolute RA SM position when in home position
@@ -45,13 +53,25 @@ HA_HOME_ABS_POSITION = int(STEPS_PER_ROT * (3/4))
 HOME_HA = 270 + 2.73
 
 # Absolute Dec SM position when in home position
-DEC_HOME_ABS_POSITION = STEPS_PER_ROT / 2
+DEC_HOME_ABS_POSITION = STEPS_PER_ROT // 2
 
 # Declination when in home positon
 HOME_DEC = -45
 
+# Travel of the RA axis in absolute steps, the home (limit) sensor is the upper end, the cable wrap allows turning down
+# to RA_MIN_POSITION (270 deg from home)
+RA_MIN_POSITION = 0
+RA_MAX_POSITION = HA_HOME_ABS_POSITION
+
+# Travel of the Dec axis in absolute steps (Dec -90 to +90 deg)
+DEC_MIN_POSITION = DEC_HOME_ABS_POSITION + round((-90 - HOME_DEC) * STEPS_PER_DEG)
+DEC_MAX_POSITION = DEC_HOME_ABS_POSITION + round((90 - HOME_DEC) * STEPS_PER_DEG)
+
 # Main menu output
-MENU_STRING = '===== eCALLISTO Master v1.0 =====\nt = track sun\nh = home\ngoto = GoTo\nm = manual control (RA and Dec)\ncoords = print current coords\nclean = release motors\n>>> '
+MENU_STRING = '===== eCALLISTO Master v1.0 =====\nt = track sun\ntarget = track another target\nh = home\ngoto = GoTo\nm = manual control (RA and Dec)\nscan = raster or drift scan around the sun\ncoords = print current coords\nclean = release motors\n>>> '
+
+# Prompt of the target menu entry, see targets.py
+TARGET_PROMPT = 'target (sun, moon, casa, cyga, taua, vira or J2000 RA,Dec in deg): '
 
 #TODO: turn these into lists
 # Scheduler nominal start time hour and minute in local timezone
@@ -69,8 +89,144 @@ OVS_TIMEM = [30, 15]
 # max current in mA
 MAX_CURRENT = 1000
 
+# Fraction of MAX_CURRENT the drivers hold the motors with at standstill, between the moves of a motion batch
+HOLD_CURRENT_MULTIPLIER = 0.3
+
+# Delay (0..15, in units of 2^18 clocks) over which a driver ramps down to the hold current after a move
+HOLD_CURRENT_DELAY = 10
+
 # default max acceleration step/s2
 MAX_ACCEL = 1000
 
 # default max speed in steps/s (from experience, stepper skips steps above 1000)
 MAX_SPEED = 1000
+
+# Step pulses/s the step generation keeps up with, limits the speed below MAX_SPEED at fine microstepping
+MAX_STEP_RATE = MAX_SPEED * MICROSTEPS
+
+# Microstepping resolution of the tracking steps, a power of two not below MICROSTEPS. It only makes the motor
+# run smoother: positions and corrections stay whole steps at MICROSTEPS, so the pointing is no finer.
+# Slews run at MICROSTEPS, a coarser resolution is no faster within MAX_STEP_RATE
+TRACK_MICROSTEPS = 16
+
+# Moves longer than this (in steps) are slews
+SLEW_MIN_STEPS = 10
+
+# Time step (in seconds) of the precomputed daily sun ephemeris table
+EPHEM_STEP = 60
+
+# Directory where the daily sun ephemeris tables are cached, None disables the disk cache
+EPHEM_CACHE_DIR = 'ephemeris_cache'
+
+# Maximum allowed error (in degrees) of the interpolated ephemeris compared to PyEphem
+EPHEM_TOLERANCE = 0.001
+
+# Maximum allowed difference (in degrees) between sidereal.py and astropy, dominated by ignoring UT1 - UTC
+SIDEREAL_TOLERANCE = 0.005
+
+# Tracking mode: 'rate' steps the RA axis on a fixed schedule, 'poll' checks the pointing error every second,
+# 'plan' plays back the whole-day plan compiled by planner.py
+TRACKING_MODE = 'rate'
+
+# Interval (in seconds) at which the constant rate tracking corrects its step rate from the ephemeris
+TRACKING_CORRECTION_INTERVAL = 300
+
+# Pointing error (in steps) above which the constant rate tracking does a goto instead of adjusting the rate
+TRACKING_MAX_RATE_ERROR = 10
+
+# Hardware backend: 'tmc2209' on the Raspberry Pi, 'sim' for the simulated driver (overridden by $ECALLISTO_BACKEND)
+BACKEND = 'tmc2209'
+
+# Whether simulated moves take as long as the modelled motion, otherwise they return immediately
+SIM_REALTIME = False
+
+# Distance (in steps) from the start position of the simulated RA driver to the limit sensor
+SIM_LIMIT_DISTANCE = 2000
+
+# Target (in seconds) for the cold start of the controller, from the first import to the end of init()
+STARTUP_TARGET = 1.0
+
+# Time (in minutes) before the nominal start time at which the scheduler starts observing
+START_LEAD_MINUTES = 60
+
+# Half length (in minutes) of the spectral overview slot centred on every OVS time
+OVS_HALF_WINDOW = 15
+
+# Position journal used to restart without homing
+JOURNAL_PATH = 'position.journal'
+
+# Records written to the journal per fsync at most
+JOURNAL_BATCH = 32
+
+# Maximum time (in seconds) a journal record stays buffered before it is fsynced
+JOURNAL_FSYNC_INTERVAL = 60
+
+# Moves longer than this (in steps) are marked in the journal before they start, a crash during them forces homing
+JOURNAL_SLEW_STEPS = 10
+
+# Age (in seconds) of the last journal record after which the antenna is homed on startup anyway
+JOURNAL_MAX_AGE = 24 * 3600
+
+# Size (in bytes) above which the journal is compacted to its last record
+JOURNAL_MAX_BYTES = 1000000
+
+# Maximum time (in seconds) for each phase of homing before the motor is stopped
+HOME_TIMEOUT = 120
+
+# Speed (in fullsteps/s) of the slow second approach to the limit sensor
+HOME_SLOW_SPEED = 20
+
+# Steps the RA axis backs off from the limit sensor before the slow approach
+HOME_BACKOFF_STEPS = 100
+
+# Directory of the daily binary telemetry files
+TELEMETRY_DIR = 'telemetry'
+
+# Records preallocated in every daily telemetry file, the file grows when they are used up
+TELEMETRY_CAPACITY = 86400
+
+# Interval (in seconds) at which the telemetry mapping is flushed to disk
+TELEMETRY_FLUSH_INTERVAL = 60
+
+# Local address of the Prometheus metrics endpoint, no endpoint is started if METRICS_PORT is None
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+
+# Interval (in seconds) at which the asyncio controller corrects the RA axis while tracking
+TRACKING_POLL_INTERVAL = 1
+
+# Unix socket of the local control API
+API_SOCKET = '/tmp/ecallisto.sock'
+
+# Time (in seconds) over which the motion of a target is probed to decide when its cached position expires
+TARGET_RATE_PROBE = 600
+
+# Maximum age (in seconds) of a cached target position, reached by fixed sources
+TARGET_CACHE_MAX_AGE = 86400
+
+# Directory of the compiled daily observing plans, see planner.py
+PLAN_DIR = 'plans'
+
+# Sampling interval (in seconds) of the sun track when compiling a plan, steps are interpolated in between
+PLAN_STEP = 60
+
+# Directory of the dwell logs of the raster and drift scans, see scans.py
+SCAN_DIR = 'scans'
+
+# Whether the step pulses are generated in a worker process per axis, see stepworker.py
+STEP_WORKER = False
+
+# CPU the step workers are pinned to (e.g. one isolated with isolcpus=3), None for no affinity
+STEP_WORKER_CPU = None
+
+# SCHED_FIFO priority of the step workers, None keeps the normal scheduling
+STEP_WORKER_PRIORITY = 50
+
+# Time (in seconds) a step worker may take beyond the modelled duration of a move before it is considered dead
+STEP_WORKER_TIMEOUT = 5
+
+# Lateness (in seconds) above which a step counts as a missed deadline
+STEP_DEADLINE_TOLERANCE = 0.0002
+
+# Last part (in seconds) of the wait for a step that is busy-waited instead of slept
+STEP_SPIN_TIME = 0.0005
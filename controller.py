@@ -0,0 +1,282 @@
+"""
+Asyncio controller running tracking, the schedule and operator commands concurrently
+
+Four tasks cooperate on one event loop:
+    tracking    corrects the RA axis once per TRACKING_POLL_INTERVAL while tracking is on
+    scheduler   follows the observing window and the spectral overviews like the auto mode of master.trackSun
+    commands    the menu of mastermanual.py (t/target/h/goto/m/coords/clean), stdin is read by the event loop
+    api         runs the goto/home/park commands queued on the control API socket, see api.py
+
+All driver calls go through a single worker thread, so moves never overlap and a
+command that moves the antenna waits for the current move only. Status queries are
+answered on the event loop from the current state and never wait for motion. An
+error of a command or a task pass is logged and published as lastError, the task
+carries on with the next one.
+
+usage: python controller.py [sim]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import concurrent.futures
+from datetime import datetime
+from constants import *
+import master
+from master import tz
+from scheduler import START, STOP, OVS_START, OVS_END
+from routines import cleanup
+from api import CommandQueue, serve
+from position import raStepsToRa, raStepsToHourAngle, decStepsToDec
+
+
+class Controller:
+    def __init__(self):
+        # single worker, every motion is serialised through it
+        self.motion = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='motion')
+        # whether the scheduler decides what the antenna does, operator moves switch it off until the next 't'
+        self.auto = True
+        self.tracking = False
+        # tracked by the tracking task while tracking is on, None for the sun
+        self.target = None
+        self.ovs = False
+        self.running = True
+        self.wakeScheduler = asyncio.Event()
+        self.commands = CommandQueue()
+
+    async def drive(self, function, *args):
+        """ runs a blocking master routine on the motion worker """
+        return await asyncio.get_running_loop().run_in_executor(self.motion, function, *args)
+
+    def fail(self, context, error):
+        """ logs the error of a command or task pass and publishes it in the status """
+        message = f'{context} failed: {type(error).__name__}: {error}'
+        print(f'{datetime.now(tz)}: {message}')
+        master.state.publish(lastError=message, lastErrorTime=time.time())
+
+    # ===== tasks =====
+    async def trackingTask(self):
+        held = False
+        while self.running:
+            try:
+                if self.tracking != held:
+                    # the drivers stay enabled at hold current between the tracking corrections
+                    for tmc in (master.tmc1, master.tmc2):
+                        await self.drive(tmc.hold if self.tracking else tmc.release)
+                    held = self.tracking
+                if self.tracking and self.target is None:
+                    await self.drive(master.trackSunOnce)
+                elif self.tracking:
+                    await self.drive(master.trackTargetOnce, self.target)
+            except Exception as e:
+                # a failing correction would fail again every pass, tracking stops until it is switched on again
+                self.fail('tracking', e)
+                self.tracking = False
+            await asyncio.sleep(TRACKING_POLL_INTERVAL)
+
+    async def schedulerTask(self):
+        while self.running:
+            self.wakeScheduler.clear()
+            timenow = datetime.now(tz)
+            try:
+                await self.schedulerPass(timenow)
+            except Exception as e:
+                self.fail('scheduler', e)
+            event = master.schedule.next(timenow)
+            try:
+                # a command switching back to auto wakes the scheduler early
+                await asyncio.wait_for(self.wakeScheduler.wait(), event.time.timestamp() - timenow.timestamp())
+            except asyncio.TimeoutError:
+                pass
+
+    async def schedulerPass(self, timenow):
+        """ does what the schedule asks for at timenow while the scheduler is in charge """
+        if self.auto:
+            if master.schedule.inWindow(timenow, OVS_START, OVS_END):
+                await self.observeOvs()
+                return
+            sunPos = master.sunEphemeris.at(timenow)
+            if master.schedule.inWindow(timenow, START, STOP) and sunPos.alt > 0:
+                if not self.tracking:
+                    print(f'{timenow}: tracking the sun')
+                    await self.drive(master.goto, sunPos.ra, True, sunPos.dec)
+                    # an operator command during the slew hands the antenna over, it is not taken back
+                    if self.auto:
+                        self.tracking = True
+            elif self.tracking:
+                print(f'{timenow}: end of observation, going home')
+                self.tracking = False
+                await self.drive(master.home)
+
+    async def apiTask(self):
+        while self.running:
+            master.state.publish(mode=self.mode())
+            command = self.commands.get()
+            if command is None:
+                await asyncio.sleep(TRACKING_POLL_INTERVAL)
+                continue
+            commandId, name, args = command
+            print(f'{datetime.now(tz)}: API command {commandId} {name} {args}')
+            self.manualMode()
+            try:
+                if name == 'goto':
+                    await self.drive(master.goto, args['ra'], False, args.get('dec'))
+                elif name == 'home':
+                    await self.drive(master.home)
+                elif name == 'park':
+                    await self.drive(master.park)
+            except Exception as e:
+                self.fail(f'API command {commandId} {name}', e)
+            master.state.publish(lastCommand=commandId)
+
+    async def observeOvs(self):
+        """ points to zenith for the spectral overview, the wait until its end does not hold the motion worker """
+        end = master.schedule.next(datetime.now(tz), (OVS_END,))
+        print(f'{datetime.now(tz)}: spectral overview until {end.time}')
+        self.tracking = False
+        self.ovs = True
+        try:
+            if master.absoluteStepperState[0] != HA_HOME_ABS_POSITION:
+                await self.drive(master.home)
+            await self.drive(master.gotoZenith)
+            await asyncio.sleep(max(0, end.time.timestamp() - datetime.now(tz).timestamp()))
+            print(f'{datetime.now(tz)}: going back home')
+            await self.drive(master.home)
+        finally:
+            self.ovs = False
+
+    async def commandTask(self):
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+        pending = ['']
+
+        def readable():
+            # stdin is read by the event loop when data is ready, nothing waits in a thread
+            data = os.read(sys.stdin.fileno(), 4096).decode()
+            if not data:
+                loop.remove_reader(sys.stdin.fileno())
+                lines.put_nowait(None)
+                return
+            *complete, pending[0] = (pending[0] + data).split('\n')
+            for line in complete:
+                lines.put_nowait(line.strip())
+
+        loop.add_reader(sys.stdin.fileno(), readable)
+
+        async def ask(prompt):
+            print(prompt, end='', flush=True)
+            line = await lines.get()
+            if line is None:
+                raise EOFError
+            return line
+
+        while self.running:
+            continuation = await ask(MENU_STRING)
+            try:
+                await self.menuCommand(continuation, ask)
+            except EOFError:
+                raise
+            except Exception as e:
+                self.fail(f'command {continuation!r}', e)
+
+    async def menuCommand(self, continuation, ask):
+        """ runs one command of the menu, ask(prompt) reads a line from stdin """
+        if continuation == 't':
+            self.auto = True
+            self.target = None
+            self.wakeScheduler.set()
+        elif continuation == 'target':
+            try:
+                target = master.targets.get(await ask(TARGET_PROMPT))
+            except ValueError as e:
+                print(e)
+                return
+            self.manualMode()
+            position = target.at(datetime.now(tz))
+            await self.drive(master.goto, position.ra, False, position.dec)
+            self.target = target
+            self.tracking = True
+        elif continuation == 'h':
+            self.manualMode()
+            await self.drive(master.home)
+        elif continuation == 'goto':
+            self.status()
+            ra = float(await ask('target RA (in deg): '))
+            self.manualMode()
+            await self.drive(master.goto, ra, False)
+        elif continuation == 'm':
+            raSteps = int(await ask('RA steps: '))
+            decSteps = int(await ask('DEC steps: '))
+            self.manualMode()
+            await self.drive(master.manual, raSteps, decSteps)
+            print('Done!')
+        elif continuation == 'scan':
+            kind = await ask('scan (raster or drift): ')
+            extent = float(await ask('extent (in deg): '))
+            spacing = float(await ask('spacing (in deg): '))
+            dwell = await ask('dwell time (in s, empty for the drift time): ')
+            self.manualMode()
+            await self.drive(master.runScan, kind, extent, spacing, float(dwell) if dwell else None)
+        elif continuation == 'coords':
+            self.status()
+        elif continuation == 'clean':
+            await self.drive(cleanup, master.tmc1)
+            await self.drive(cleanup, master.tmc2)
+        elif (await ask('Are you sure about that? [y/n]\n>>> ')) == 'y':
+            self.running = False
+            self.wakeScheduler.set()
+
+    def manualMode(self):
+        """ hands the antenna to the operator, tracking and the schedule stop until the next 't' """
+        self.auto = False
+        self.tracking = False
+
+    def mode(self):
+        if self.tracking and self.target is not None:
+            return f'tracking {self.target.name}'
+        return 'ovs' if self.ovs else 'tracking' if self.tracking else 'auto' if self.auto else 'manual'
+
+    def status(self):
+        """ prints the current pointing from the state, without touching the drivers or waiting for a move """
+        timenow = datetime.now(tz)
+        sunPos = master.sunEphemeris.at(timenow)
+        raSteps, decSteps = master.absoluteStepperState
+        print(f'{timenow} [{self.mode()}] | {sunPos.ra}, {sunPos.dec}, {sunPos.ha} | '
+              f'{round(raStepsToRa(raSteps, timenow.timestamp()), 9)}, {round(decStepsToDec(decSteps), 9)} '
+              f'{round(raStepsToHourAngle(raSteps), 9)} | {master.absoluteStepperState}')
+
+    async def run(self):
+        tasks = [asyncio.create_task(task) for task in (self.trackingTask(), self.schedulerTask(), self.commandTask(),
+                                                        self.apiTask())]
+        server = serve(master.state, self.commands)
+        try:
+            while self.running and not tasks[2].done():
+                await asyncio.sleep(TRACKING_POLL_INTERVAL)
+        finally:
+            self.tracking = False
+            if server is not None:
+                server.shutdown()
+            asyncio.get_running_loop().remove_reader(sys.stdin.fileno())
+            for task in tasks:
+                task.cancel()
+            for task, result in zip(tasks, await asyncio.gather(*tasks, return_exceptions=True)):
+                # cancelled tasks return CancelledError (not an Exception), EOFError is the end of stdin
+                if isinstance(result, Exception) and not isinstance(result, EOFError):
+                    self.fail(task.get_coro().__qualname__, result)
+            await self.drive(cleanup, master.tmc1)
+            await self.drive(cleanup, master.tmc2)
+            self.motion.shutdown()
+
+
+if __name__ == '__main__':
+    master.init(sys.argv[1] if len(sys.argv) > 1 else None)
+    if not master.restorePosition():
+        master.home()
+    try:
+        asyncio.run(Controller().run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        master.journal.close()
+        master.telemetry.close()
@@ -0,0 +1,233 @@
+"""
+Precomputed daily solar ephemeris
+
+The sun position is computed with PyEphem once per UTC day on a fixed time grid
+(EPHEM_STEP) and every query during the day is answered by linear interpolation
+of that table. Tables are optionally cached on disk, keyed by station and date.
+NumPy is imported when the first table is loaded, not at import time, as in
+telemetry, planner and scans, so importing master does not load it.
+"""
+
+import os
+import ephem
+from collections import namedtuple
+from datetime import datetime, timezone
+from constants import *
+
+# Sun position, all angles in degrees
+SunPosition = namedtuple('SunPosition', ['ra', 'dec', 'alt', 'ha'])
+
+# Offset between unix time and the PyEphem (Dublin Julian) day count
+EPHEM_UNIX_EPOCH = 25567.5
+
+# Column indices of the ephemeris table
+RA, DEC, ALT, HA = range(4)
+
+
+def toTimestamp(t):
+    """ converts a datetime (naive datetimes are treated as UTC) or a unix timestamp to a unix timestamp
+
+    Args:
+        t (datetime or float): time to convert
+
+    Returns:
+        float: unix timestamp
+    """
+    if isinstance(t, datetime):
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+        return t.timestamp()
+    return float(t)
+
+
+def makeObserver(lat=LAT, lon=LON, elevation=ALTITUDE):
+    """ creates a PyEphem observer for the station
+
+    Returns:
+        ephem.Observer: observer at the given location
+    """
+    observer = ephem.Observer()
+    observer.lon = str(lon)
+    observer.lat = str(lat)
+    observer.elevation = elevation
+    return observer
+
+
+def computeSun(observer, sun, ts):
+    """ computes the sun position directly with PyEphem
+
+    Args:
+        observer (ephem.Observer): station observer, its date is changed
+        sun (ephem.Sun): sun body
+        ts (float): unix timestamp
+
+    Returns:
+        SunPosition: sun position in degrees
+    """
+    observer.date = ts / 86400 + EPHEM_UNIX_EPOCH
+    sun.compute(observer)
+    ra = float(sun.ra) * RAD_TO_DEG_FACTOR
+    ha = (float(observer.sidereal_time()) * RAD_TO_DEG_FACTOR - ra) % 360
+    return SunPosition(ra, float(sun.dec) * RAD_TO_DEG_FACTOR, float(sun.alt) * RAD_TO_DEG_FACTOR, ha)
+
+
+def dayStart(ts):
+    """ returns the unix timestamp of the UTC midnight preceding ts """
+    return ts - ts % 86400
+
+
+def computeTable(start, observer, step=EPHEM_STEP):
+    """ computes the sun ephemeris table for one UTC day
+
+    RA and HA are unwrapped so they can be interpolated across 0/360.
+
+    Args:
+        start (float): unix timestamp of UTC midnight
+        observer (ephem.Observer): station observer
+        step (int): grid step in seconds
+
+    Returns:
+        numpy.ndarray: array of shape (86400 / step + 1, 4) with columns RA, DEC, ALT, HA in degrees
+    """
+    import numpy as np
+
+    sun = ephem.Sun()
+    n = int(86400 // step) + 1
+    table = np.empty((n, 4))
+    for i in range(n):
+        table[i] = computeSun(observer, sun, start + i * step)
+    table[:, RA] = np.degrees(np.unwrap(np.radians(table[:, RA])))
+    table[:, HA] = np.degrees(np.unwrap(np.radians(table[:, HA])))
+    return table
+
+
+class SunEphemeris:
+    """ interpolated sun ephemeris for one station, rebuilt automatically when the day changes """
+
+    def __init__(self, lat=LAT, lon=LON, elevation=ALTITUDE, step=EPHEM_STEP, cacheDir=EPHEM_CACHE_DIR):
+        self.lat = lat
+        self.lon = lon
+        self.elevation = elevation
+        self.step = step
+        self.cacheDir = cacheDir
+        self.observer = makeObserver(lat, lon, elevation)
+        self.start = None
+        self.end = None
+        self.table = None
+
+    def cachePath(self, start):
+        """ returns the on-disk location of the table starting at the given UTC midnight """
+        day = datetime.fromtimestamp(start, timezone.utc).strftime('%Y%m%d')
+        name = f'sun_{self.lat:.6f}_{self.lon:.6f}_{self.elevation:g}_{self.step:g}_{day}.npy'
+        return os.path.join(self.cacheDir, name)
+
+    def load(self, ts):
+        """ makes the table covering ts current, reading it from disk or computing it
+
+        Args:
+            ts (float): unix timestamp inside the wanted day
+        """
+        import numpy as np
+
+        start = dayStart(ts)
+        n = int(86400 // self.step) + 1
+        table = None
+        if self.cacheDir:
+            path = self.cachePath(start)
+            if os.path.exists(path):
+                try:
+                    table = np.load(path)
+                except (OSError, ValueError):
+                    table = None
+                if table is not None and table.shape != (n, 4):
+                    table = None
+        if table is None:
+            table = computeTable(start, self.observer, self.step)
+            if self.cacheDir:
+                os.makedirs(self.cacheDir, exist_ok=True)
+                np.save(self.cachePath(start), table)
+        self.table = table
+        self.start = start
+        self.end = start + (n - 1) * self.step
+
+    def at(self, t):
+        """ returns the interpolated sun position
+
+        Args:
+            t (datetime or float): time of the query
+
+        Returns:
+            SunPosition: sun position in degrees, RA and HA in [0, 360)
+        """
+        ts = toTimestamp(t)
+        if self.table is None or not self.start <= ts <= self.end:
+            # stale table, move on to the day of the query
+            self.load(ts)
+        x = (ts - self.start) / self.step
+        i = min(int(x), len(self.table) - 2)
+        f = x - i
+        a = self.table[i]
+        b = self.table[i + 1]
+        return SunPosition((a[RA] + (b[RA] - a[RA]) * f) % 360,
+                           a[DEC] + (b[DEC] - a[DEC]) * f,
+                           a[ALT] + (b[ALT] - a[ALT]) * f,
+                           (a[HA] + (b[HA] - a[HA]) * f) % 360)
+
+    def atMany(self, ts):
+        """ vectorized version of at() for timestamps within a single UTC day
+
+        Args:
+            ts (array_like): unix timestamps
+
+        Returns:
+            numpy.ndarray: array of shape (len(ts), 4) with columns RA, DEC, ALT, HA in degrees
+        """
+        import numpy as np
+
+        ts = np.asarray(ts, dtype=float)
+        self.at(float(ts.min()))
+        if ts.max() > self.end:
+            raise ValueError('atMany() only accepts timestamps from a single UTC day')
+        grid = self.start + np.arange(len(self.table)) * self.step
+        result = np.empty((len(ts), 4))
+        for column in range(4):
+            result[:, column] = np.interp(ts, grid, self.table[:, column])
+        result[:, RA] %= 360
+        result[:, HA] %= 360
+        return result
+
+    def checkAccuracy(self, t=None, samples=500):
+        """ compares the interpolated table against direct PyEphem computations
+
+        Args:
+            t (datetime or float): any time inside the day to check, defaults to now
+            samples (int): number of random times to compare
+
+        Returns:
+            dict: maximum absolute error in degrees for every column and whether all are within EPHEM_TOLERANCE
+                (altitude is only compared above -2 deg)
+        """
+        import numpy as np
+
+        ts = toTimestamp(t if t is not None else datetime.now(timezone.utc))
+        self.at(ts)
+        times = self.start + np.random.default_rng().uniform(0, self.end - self.start, samples)
+        observer = makeObserver(self.lat, self.lon, self.elevation)
+        sun = ephem.Sun()
+        errors = np.zeros(4)
+        for ts in times:
+            exact = computeSun(observer, sun, ts)
+            approx = self.at(ts)
+            diff = np.abs(np.subtract(approx, exact))
+            diff[[RA, HA]] = np.minimum(diff[[RA, HA]], 360 - diff[[RA, HA]])
+            if exact.alt < -2:
+                # PyEphem's refraction model has a kink a few degrees below the horizon, irrelevant for observing
+                diff[ALT] = 0
+            errors = np.maximum(errors, diff)
+        result = dict(zip(SunPosition._fields, errors.tolist()))
+        result['ok'] = bool(errors.max() <= EPHEM_TOLERANCE)
+        return result
+
+
+if __name__ == '__main__':
+    print(SunEphemeris().checkAccuracy())
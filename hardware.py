@@ -0,0 +1,378 @@
+"""
+Hardware backends for the stepper drivers and the limit sensor
+
+The backend is selected by BACKEND in constants.py or the ECALLISTO_BACKEND environment variable:
+    'tmc2209'   TMC_2209 stepper driver library and RPi.GPIO, used on the Raspberry Pi
+    'sim'       simulated TMC2209 driver and GPIO, runs on any machine
+
+Every backend provides:
+    createDriver(enPin, stepPin, dirPin, port, address)
+                                            a driver on the UART port with the driver address, with
+                                            the part of the TMC_2209 API used by routines.setupTMC,
+                                            routines.moveStepper and routines.cleanup
+    setupLimit(pin) / readLimit(pin)        limit sensor setup and reads, readLimit is falsy when triggered
+    watchLimit(pin, callback)               calls callback(pin) from the GPIO edge detection when the sensor triggers
+    unwatchLimit(pin)                       removes the callback again
+    gpio                                    the RPi.GPIO compatible module
+"""
+
+import os
+import math
+import time
+from enum import Enum
+from constants import *
+# https://github.com/Chr157i4n/TMC2209_Raspberry_Pi/tree/main
+try:
+    from src.TMC_2209.TMC_2209_StepperDriver import TMC_2209, Loglevel, MovementAbsRel, StopMode
+except ModuleNotFoundError:
+    try:
+        from TMC_2209.TMC_2209_StepperDriver import TMC_2209, Loglevel, MovementAbsRel, StopMode
+    except ModuleNotFoundError:
+        # library not installed, the simulated backend brings its own copies of the enums
+        TMC_2209 = None
+
+        class Loglevel(Enum):
+            ALL = 1
+            MOVEMENT = 5
+            DEBUG = 10
+            INFO = 20
+            WARNING = 30
+            ERROR = 40
+            NONE = -1
+
+        class MovementAbsRel(Enum):
+            ABSOLUTE = 0
+            RELATIVE = 1
+
+        class StopMode(Enum):
+            NO = 0
+            SOFTSTOP = 1
+            HARDSTOP = 2
+
+
+def moveDuration(steps, maxSpeed, acceleration):
+    """ duration of a move with a trapezoidal (or triangular, for short moves) speed profile
+
+    Args:
+        steps (int): length of the move, the sign is ignored
+        maxSpeed (float): maximum speed in steps/s
+        acceleration (float): acceleration and deceleration in steps/s^2
+
+    Returns:
+        float: duration of the move in seconds
+    """
+    steps = abs(steps)
+    if steps == 0:
+        return 0.0
+    rampSteps = maxSpeed * maxSpeed / acceleration
+    if steps < rampSteps:
+        # never reaches maxSpeed
+        return 2 * math.sqrt(steps / acceleration)
+    return maxSpeed / acceleration + steps / maxSpeed
+
+
+class SimulatedLogger:
+    """ stand-in for the TMC_2209 logger, messages are dropped """
+
+    def set_loglevel(self, loglevel):
+        pass
+
+    def log(self, message, loglevel=None):
+        pass
+
+
+class SimulatedTMC:
+    """ stand-in for TMC_2209 that models the motion of the motor instead of driving it
+
+    Moves follow a trapezoidal speed profile limited by the configured maximum speed and acceleration.
+    With realtime=True a move blocks for its modelled duration, otherwise the duration is only accumulated
+    in motionTime. Steps issued while the driver is disabled are counted as lost, like on the real motor.
+    The motor position is a microstep counter (counts), position is in steps at the current resolution.
+    """
+
+    # Microstep counter units per full step, like MSCNT of the TMC2209, every resolution moves whole counts
+    FULLSTEP_COUNTS = 256
+
+    def __init__(self, pin_en=-1, pin_step=-1, pin_dir=-1, realtime=False):
+        self.tmc_logger = SimulatedLogger()
+        self.pins = (pin_en, pin_step, pin_dir)
+        self.realtime = realtime
+        self.gpio = None
+        self.enabled = False
+        self.counts = 0
+        self.movementAbsRel = MovementAbsRel.ABSOLUTE
+        self.stopMode = StopMode.NO
+        self.msres = MICROSTEPS
+        self.current = 0
+        # same defaults as the TMC_2209 constructor
+        self.maxSpeed = 100 * self.msres
+        self.acceleration = 100 * self.msres
+        # statistics
+        self.moves = 0
+        self.steps = 0
+        self.lostSteps = 0
+        self.motionTime = 0.0
+        self.registerWrites = 0
+        self.enableToggles = 0
+
+    # ----- register settings -----
+    def set_movement_abs_rel(self, movement_abs_rel):
+        self.movementAbsRel = movement_abs_rel
+
+    def set_direction_reg(self, direction):
+        self.registerWrites += 1
+
+    def set_current(self, run_current, hold_current_multiplier=0.5, hold_current_delay=10, pdn_disable=True):
+        self.current = run_current
+        self.registerWrites += 1
+
+    def set_interpolation(self, en):
+        self.registerWrites += 1
+
+    def set_spreadcycle(self, en_spread):
+        self.registerWrites += 1
+
+    def set_internal_rsense(self, en):
+        self.registerWrites += 1
+
+    def set_microstepping_resolution(self, msres):
+        self.msres = msres
+        self.registerWrites += 1
+
+    def get_microstepping_resolution(self):
+        return self.msres
+
+    @property
+    def stride(self):
+        """ counts per step at the current resolution """
+        return self.FULLSTEP_COUNTS // self.msres
+
+    @property
+    def position(self):
+        return self.counts // self.stride
+
+    @position.setter
+    def position(self, value):
+        # relative to the current counts, so the motor keeps its phase between the steps
+        self.counts += (value - self.position) * self.stride
+
+    # ----- motion -----
+    def set_motor_enabled(self, en):
+        if en != self.enabled:
+            self.enableToggles += 1
+        self.enabled = en
+
+    def set_max_speed(self, speed):
+        self.maxSpeed = abs(speed)
+
+    def set_max_speed_fullstep(self, speed):
+        self.set_max_speed(speed * self.msres)
+
+    def get_max_speed(self):
+        return self.maxSpeed
+
+    def set_acceleration(self, acceleration):
+        if acceleration != 0:
+            self.acceleration = abs(acceleration)
+
+    def set_acceleration_fullstep(self, acceleration):
+        self.set_acceleration(acceleration * self.msres)
+
+    def get_acceleration(self):
+        return self.acceleration
+
+    def get_current_position(self):
+        return self.position
+
+    def set_current_position(self, new_pos):
+        self.position = new_pos
+
+    def stop(self, stop_mode=StopMode.HARDSTOP):
+        self.stopMode = stop_mode
+
+    def run_to_position_steps(self, steps, movement_abs_rel=None):
+        """ moves the simulated motor, fires limit sensor edges on the way and honours stop() from a callback
+
+        Returns:
+            StopMode: how the movement was finished
+        """
+        if movement_abs_rel is None:
+            movement_abs_rel = self.movementAbsRel
+        target = self.position + steps if movement_abs_rel == MovementAbsRel.RELATIVE else steps
+        self.stopMode = StopMode.NO
+        if not self.enabled:
+            self.lostSteps += abs(target - self.position)
+            return self.stopMode
+        start = self.counts
+        end = start + (target - self.position) * self.stride
+        if self.gpio is not None:
+            end = self.gpio.simulateMove(self, start, end)
+        distance = (end - start) // self.stride
+        duration = moveDuration(distance, self.maxSpeed, self.acceleration)
+        self.counts = end
+        self.moves += 1
+        self.steps += abs(distance)
+        self.motionTime += duration
+        if self.realtime:
+            time.sleep(duration)
+        return self.stopMode
+
+
+class SimulatedGPIO:
+    """ stand-in for RPi.GPIO, the level of a limit sensor pin follows the position of its simulated driver """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_UP = 22
+    PUD_DOWN = 21
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.levels = {}
+        self.limits = {}
+        self.callbacks = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode, initial=LOW, pull_up_down=PUD_OFF):
+        self.levels.setdefault(pin, initial if mode == self.OUT else self.HIGH)
+
+    def cleanup(self, pin=None):
+        pass
+
+    def output(self, pin, value):
+        self.levels[pin] = value
+
+    def input(self, pin):
+        if pin in self.limits:
+            driver, triggerCounts = self.limits[pin]
+            return self.LOW if driver.counts >= triggerCounts else self.HIGH
+        return self.levels.get(pin, self.HIGH)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def attachLimit(self, pin, driver, triggerCounts):
+        """ makes pin a limit sensor that goes low once the microstep counter of driver reaches triggerCounts """
+        self.limits[pin] = (driver, triggerCounts)
+        driver.gpio = self
+
+    def simulateMove(self, driver, start, target):
+        """ fires the edge callbacks crossed by a move of driver from start to target counts and returns the counts
+        where the move ends, always a whole number of steps from start
+        """
+        stride = driver.stride
+        for pin, (limitDriver, triggerCounts) in self.limits.items():
+            if limitDriver is not driver or pin not in self.callbacks:
+                continue
+            edge, callback = self.callbacks[pin]
+            if start < triggerCounts <= target and edge in (self.FALLING, self.BOTH):
+                # first step at or past the sensor
+                crossing = start + -((start - triggerCounts) // stride) * stride
+            elif target < triggerCounts <= start and edge in (self.RISING, self.BOTH):
+                # first step before the sensor
+                crossing = start - ((start - triggerCounts) // stride + 1) * stride
+            else:
+                continue
+            if callback is not None:
+                driver.counts = crossing
+                callback(pin)
+                driver.counts = start
+            if driver.stopMode != StopMode.NO:
+                return crossing
+        return target
+
+
+class TMC2209Backend:
+    """ TMC_2209 library and RPi.GPIO on the Raspberry Pi """
+
+    name = 'tmc2209'
+
+    def __init__(self):
+        if TMC_2209 is None:
+            raise ModuleNotFoundError('the TMC_2209 library is required for the tmc2209 backend')
+        import RPi.GPIO
+        self.gpio = RPi.GPIO
+
+    def createDriver(self, enPin, stepPin, dirPin, port=RA_UART_PORT, address=RA_UART_ADDRESS):
+        return TMC_2209(enPin, stepPin, dirPin, serialport=port, driver_address=address)
+
+    def setupLimit(self, pin):
+        self.gpio.setup(pin, self.gpio.IN)
+
+    def readLimit(self, pin):
+        return self.gpio.input(pin)
+
+    def watchLimit(self, pin, callback):
+        self.gpio.add_event_detect(pin, self.gpio.FALLING, callback=callback)
+
+    def unwatchLimit(self, pin):
+        self.gpio.remove_event_detect(pin)
+
+
+class SimulatedBackend:
+    """ simulated drivers and GPIO, the limit sensor sits SIM_LIMIT_DISTANCE steps ahead of the start position """
+
+    name = 'sim'
+
+    def __init__(self, realtime=SIM_REALTIME):
+        self.realtime = realtime
+        self.gpio = SimulatedGPIO()
+        self.drivers = []
+
+    def createDriver(self, enPin, stepPin, dirPin, port=RA_UART_PORT, address=RA_UART_ADDRESS):
+        driver = SimulatedTMC(enPin, stepPin, dirPin, self.realtime)
+        driver.uart = (port, address)
+        self.drivers.append(driver)
+        return driver
+
+    def setupLimit(self, pin, driver=None):
+        """ the limit sensor is attached to the first driver unless another one is given """
+        self.gpio.setup(pin, self.gpio.IN)
+        driver = driver if driver is not None else self.drivers[0]
+        self.gpio.attachLimit(pin, driver, driver.counts + SIM_LIMIT_DISTANCE * driver.stride)
+
+    def readLimit(self, pin):
+        return self.gpio.input(pin)
+
+    def watchLimit(self, pin, callback):
+        self.gpio.add_event_detect(pin, self.gpio.FALLING, callback=callback)
+
+    def unwatchLimit(self, pin):
+        self.gpio.remove_event_detect(pin)
+
+
+BACKENDS = {
+    TMC2209Backend.name: TMC2209Backend,
+    SimulatedBackend.name: SimulatedBackend,
+}
+
+
+def getBackend(name=None):
+    """ creates the hardware backend
+
+    Args:
+        name (str): 'tmc2209' or 'sim', defaults to $ECALLISTO_BACKEND or BACKEND
+
+    Returns:
+        TMC2209Backend or SimulatedBackend: the backend
+    """
+    if name is None:
+        name = os.environ.get('ECALLISTO_BACKEND', BACKEND)
+    if name not in BACKENDS:
+        raise ValueError(f'unknown backend {name!r}, expected one of {sorted(BACKENDS)}')
+    return BACKENDS[name]()
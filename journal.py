@@ -0,0 +1,172 @@
+"""
+Crash-safe position journal
+
+Every change of the absolute stepper position is appended to a text journal, one
+checksummed record per line:
+    seq time raSteps decSteps pointingRa pointingDec state homed crc32
+
+Records are buffered and written with fsync every JOURNAL_BATCH records or
+JOURNAL_FSYNC_INTERVAL seconds, whichever comes first. The first record of a batch
+is preceded by a synced 'unsynced' record, so a crash that loses the buffer is
+detected, and slews are bracketed by a 'moving' record that is synced before the
+motion starts, so a crash in the middle of a slew is always detected. On restart replay() returns the last consistent
+record and restoreDecision() tells whether it can be trusted or the antenna has
+to be homed again.
+"""
+
+import os
+import time
+import zlib
+from collections import namedtuple
+from constants import *
+
+# Record states
+IDLE = 'idle'
+MOVING = 'moving'
+UNSYNCED = 'unsynced'
+
+Record = namedtuple('Record', ['seq', 'time', 'raSteps', 'decSteps', 'pointingRa', 'pointingDec', 'state', 'homed'])
+
+
+def formatRecord(record):
+    """ journal line of a record, including the checksum """
+    body = (f'{record.seq} {record.time:.3f} {record.raSteps} {record.decSteps} '
+            f'{record.pointingRa:.9f} {record.pointingDec:.9f} {record.state} {int(record.homed)}')
+    return f'{body} {zlib.crc32(body.encode()):08x}\n'
+
+
+def parseRecord(line):
+    """ parses a journal line
+
+    Returns:
+        Record: the record, None if the line is torn or its checksum does not match
+    """
+    body, _, crc = line.rstrip('\n').rpartition(' ')
+    try:
+        if int(crc, 16) != zlib.crc32(body.encode()):
+            return None
+        seq, t, raSteps, decSteps, pointingRa, pointingDec, state, homed = body.split(' ')
+        return Record(int(seq), float(t), int(raSteps), int(decSteps), float(pointingRa), float(pointingDec),
+                      state, homed == '1')
+    except ValueError:
+        return None
+
+
+def replay(path=JOURNAL_PATH):
+    """ reads the journal and returns the last consistent record
+
+    Lines with a bad checksum (e.g. torn by a power loss) and records that do not continue
+    the sequence are skipped.
+
+    Returns:
+        Record: the last consistent record, None if there is none
+    """
+    last = None
+    try:
+        with open(path) as f:
+            for line in f:
+                record = parseRecord(line)
+                if record is not None and (last is None or record.seq > last.seq):
+                    last = record
+    except FileNotFoundError:
+        return None
+    return last
+
+
+def restoreDecision(record, now=None):
+    """ decides whether the antenna position can be taken from the journal
+
+    Args:
+        record (Record): last consistent record, see replay
+        now (float): unix timestamp, defaults to now
+
+    Returns:
+        tuple: (bool, str) whether the record can be used and why
+    """
+    if now is None:
+        now = time.time()
+    if record is None:
+        return False, 'no journal'
+    if not record.homed:
+        return False, 'antenna was never homed'
+    if record.state == MOVING:
+        return False, 'interrupted during a slew'
+    if record.state == UNSYNCED:
+        return False, 'buffered records were lost'
+    if now - record.time > JOURNAL_MAX_AGE:
+        return False, f'last record is older than {JOURNAL_MAX_AGE} s'
+    return True, f'restored from record {record.seq}'
+
+
+class PositionJournal:
+    """ append-only writer of the position journal with batched fsync """
+
+    def __init__(self, path=JOURNAL_PATH, batch=JOURNAL_BATCH, interval=JOURNAL_FSYNC_INTERVAL):
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        last = replay(path)
+        self.seq = last.seq if last is not None else 0
+        self.buffer = []
+        self.lastSync = time.monotonic()
+        self.syncs = 0
+        self.file = open(path, 'a')
+
+    def record(self, raSteps, decSteps, pointingRa, pointingDec, state=IDLE, homed=True, sync=False):
+        """ appends a record, it is written to disk with the next batch unless sync is True
+
+        Args:
+            raSteps (int): absolute RA stepper position
+            decSteps (int): absolute Dec stepper position
+            pointingRa (float): RA of the pointing in degrees
+            pointingDec (float): Dec of the pointing in degrees
+            state (str): IDLE, or MOVING before a slew to the given position starts
+            homed (bool): whether the position is referenced to the home sensor
+            sync (bool): write and fsync immediately
+        """
+        now = time.time()
+        flush = sync or len(self.buffer) + 1 >= self.batch or time.monotonic() - self.lastSync >= self.interval
+        if not flush and not self.buffer:
+            self.seq += 1
+            self.buffer.append(formatRecord(Record(self.seq, now, int(raSteps), int(decSteps), pointingRa, pointingDec,
+                                                   UNSYNCED, homed)))
+            self.flush()
+        self.seq += 1
+        self.buffer.append(formatRecord(Record(self.seq, now, int(raSteps), int(decSteps),
+                                               pointingRa, pointingDec, state, homed)))
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """ writes the buffered records and fsyncs the journal """
+        if self.buffer:
+            self.file.write(''.join(self.buffer))
+            self.buffer = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.lastSync = time.monotonic()
+        self.syncs += 1
+        if self.file.tell() > JOURNAL_MAX_BYTES:
+            self.compact()
+
+    def compact(self):
+        """ atomically replaces the journal by its last record """
+        last = replay(self.path)
+        self.file.close()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            if last is not None:
+                f.write(formatRecord(last))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self.file = open(self.path, 'a')
+
+    def close(self):
+        self.flush()
+        self.file.close()
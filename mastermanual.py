@@ -6,143 +6,337 @@ main control program for the callisto station Visnjan
 @author: M. Markovic
 """
 
-import ephem
 import time
-import astropy.units as u
-from astropy.coordinates import EarthLocation, Angle
-from astropy.time import Time
-from datetime import datetime, timedelta
-import RPi.GPIO as g
+# reference for the startup time reported by init()
+importStart = time.perf_counter()
+from time import perf_counter
+import math
+from datetime import datetime, timedelta, timezone
 from constants import *
 from routines import *
+from hardware import getBackend
+from clock import SystemClock
+from ephemeris import SunEphemeris, makeObserver
+from sidereal import localSiderealTime
+from scheduler import Schedule, OVS_START, OVS_END
+from journal import PositionJournal, replay, restoreDecision, IDLE, MOVING
+from telemetry import TelemetryRecorder
+from api import StateCache
+from targets import TargetRegistry
+from session import DriverSession, motionBatch
+from stepworker import StepWorker
+from slew import planSlew, checkMove, SlewLimitError
+import automode
+from planner import getPlan, trackingIntervals, PlanExecutor, RA_AXIS, DEC_AXIS
+from scans import buildTrajectory, DwellLog, dwellLogPath
+from position import raStepsToHourAngle, raStepsToRa, decStepsToDec, hourAngleToRaSteps, raToRaSteps, decToDecSteps
+import metrics
+from metrics import timed, LOOP_SECONDS, STEPS, EPHEMERIS_SECONDS, POINTING_ERROR, AUTO_STATE
 import pytz
-try:
-    from src.TMC_2209.TMC_2209_StepperDriver import *
-    from src.TMC_2209._TMC_2209_GPIO_board import Board
-except ModuleNotFoundError:
-    from TMC_2209.TMC_2209_StepperDriver import *
-    from TMC_2209._TMC_2209_GPIO_board import Board
 
 # local timezone
 tz = pytz.timezone('Europe/Berlin')
 
-# This is initialized as in the middle of the stepper range (1 revolution is 660 000 steps), needs to be updated when homed
-absoluteStepperState = [STEPS_PER_ROT/2, STEPS_PER_ROT/2] # for RA and Dec
-# Format: time; RA; DEC
-pointing = [datetime.now(tz), 0, 0]
+# every routine reads the time through this clock, see setClock
+clock = SystemClock()
 
-# Initializing the motor GPIO pins and the optical limit sensors 
-# all in GPIO notation, not physical
-# initiate and setup the TMC_2209 class
-enPin = 21
-dirPin = 20
-stepPin = 16
-limit = 17
+# This is initialized as in the middle of the stepper range (1 revolution is 660 000 steps), needs to be updated when homed.
+# The absolute step counts are the position model, see position.py
+absoluteStepperState = [STEPS_PER_ROT//2, DEC_HOME_ABS_POSITION] # for RA and Dec
+# Format: time; RA; DEC, derived from absoluteStepperState by updatePointing()
+pointing = [clock.now(tz), 0, HOME_DEC]
+# whether absoluteStepperState is referenced to the limit sensor, by home() or by the position journal
+homed = False
 
-tmc1 = TMC_2209(enPin, stepPin, dirPin)
-g.setup(limit, g.IN)
-setupTMC(tmc1)
+# Hardware, PyEphem and ephemeris handles, created by init()
+backend = None
+g = None
+tmc1 = None # RA
+tmc2 = None # Dec
+observer = None
+sunEphemeris = None
+sunPos = None
+schedule = None
+targets = None
+journal = None
+telemetry = None
 
-# PyEphem variables
-observer = ephem.Observer()
-observer.lon = str(LON)
-observer.lat = str(LAT)
-observer.date = datetime.now(tz)
-observer.elevation = ALTITUDE
-sun = ephem.Sun(observer)
+# Snapshot of the last computed state, served by the control API without recomputing anything
+state = StateCache()
 
-# Astropy variables
-loc = EarthLocation(lat = LAT*u.deg, lon = LON*u.deg, height = ALTITUDE*u.m)
+# Current state of the auto mode (see automode.py) and the end of the current tracking period
+autoState = automode.IDLE
+trackUntil = None
 
-print('           UTC             |   Sun RA      Sun Dec     Sun HA    |    antenna RA     antenna Dec     antenna HA    |     absoluteStepperState     ')
+# Duration (in seconds) of the startup phases, filled in by init()
+startupTimes = {}
 
-lastPrint = datetime.now(tz)
+lastPrint = clock.now(tz)
 
-def trackSun():
+def init(backendName=None):
     '''
-    tracks the sun assuming the antenna has been homed
+    initialises the controller, has to be called once before any other routine.
+    Sets up the hardware backend, the TMC driver and limit sensor, the observer and today's sun ephemeris
+    and reports the startup time against STARTUP_TARGET
+
+    Args:
+        backendName (str): hardware backend, see hardware.getBackend
     '''
-    global pointing
+    global backend
+    global g
+    global tmc1
+    global tmc2
     global observer
-    global sun
-    global loc
+    global sunEphemeris
+    global sunPos
+    global schedule
+    global targets
+    global journal
+    global telemetry
+    global startupTimes
+
+    initStart = time.perf_counter()
+    startupTimes['imports'] = initStart - importStart
+
+    # initiate and setup the TMC_2209 class
+    backend = getBackend(backendName)
+    g = backend.gpio
+    tmc1 = DriverSession(backend.createDriver(enPin, stepPin, dirPin, RA_UART_PORT, RA_UART_ADDRESS), 'ra',
+                         RA_UART_PORT)
+    tmc2 = DriverSession(backend.createDriver(decEnPin, decStepPin, decDirPin, DEC_UART_PORT, DEC_UART_ADDRESS),
+                         'dec', DEC_UART_PORT)
+    backend.setupLimit(LIMIT_PIN)
+    setupTMC(tmc1)
+    setupTMC(tmc2)
+    if STEP_WORKER:
+        tmc1.worker = StepWorker(backend.name, stepPin, dirPin, 'ra')
+        tmc2.worker = StepWorker(backend.name, decStepPin, decDirPin, 'dec')
+    hardwareDone = time.perf_counter()
+    startupTimes['hardware'] = hardwareDone - initStart
+
+    # Interpolated daily sun ephemeris, used instead of sun.compute in the control loop
+    observer = makeObserver()
+    sunEphemeris = SunEphemeris()
+    sunEphemeris.at = timed(EPHEMERIS_SECONDS)(sunEphemeris.at)
+    sunPos = sunEphemeris.at(clock.now(tz))
+    schedule = Schedule(tz, observer)
+    targets = TargetRegistry(sunEphemeris)
+    journal = PositionJournal()
+    telemetry = TelemetryRecorder()
+    if METRICS_PORT is not None:
+        metrics.serve()
+    startupTimes['ephemeris'] = time.perf_counter() - hardwareDone
+    startupTimes['total'] = time.perf_counter() - importStart
+
+    print(f"startup {startupTimes['total']:.2f} s (imports {startupTimes['imports']:.2f} s, hardware {startupTimes['hardware']:.2f} s, ephemeris {startupTimes['ephemeris']:.2f} s)")
+    if startupTimes['total'] > STARTUP_TARGET:
+        print(f'startup took longer than the {STARTUP_TARGET} s target')
+    print('           UTC             |   Sun RA      Sun Dec     Sun HA    |    antenna RA     antenna Dec     antenna HA    |     absoluteStepperState     ')
+
+def setClock(newClock):
+    '''
+    makes every routine read the time from newClock, e.g. a clock.VirtualClock to replay a day in seconds.
+    Returns the previous clock
+    '''
+    global clock
     global lastPrint
-    global absoluteStepperState
+    previous = clock
+    clock = newClock
+    pointing[0] = clock.now(tz)
+    lastPrint = clock.now(tz) - timedelta(seconds=PRINT_FREQ)
+    return previous
 
-    observer.date = datetime.now(tz)
-    sun.compute(observer)
-    
-    waitForSchedule()
-    print("Sun: ", sun.ra * RAD_TO_DEG_FACTOR, "Antenna: ", pointing[1])
-    while sun.alt < 0:
-        observer.date = datetime.now(tz)
-        sun.compute(observer)
-        time.sleep(15)
-    goto(sun.ra * RAD_TO_DEG_FACTOR, True)
-    print('tracking')
-    
-    obsEndTime = datetime.now().replace(hour=STOP_TIME_HOUR, minute=STOP_TIME_MINUTE, second=0, microsecond=0)
-    
+def trackSun():
+    '''
+    runs the auto mode: a flat loop over the states of automode.py, driven by the schedule, until interrupted.
+    Every pass makes one transition or one step of the current state
+    '''
     try:
-        while True:
-            # Update PyEphem variables: time, sun coords
-            timenow = datetime.now(tz)
-            observer.date = timenow
-            sun.compute(observer)
-            
-            # Update antenna pointing due to earth rotation
-            pointing[1] += (timenow - pointing[0]).total_seconds() * DEG_PER_SECOND
-            pointing[0] = timenow
-            
-            # Compute local hour angle of the pointing
-            lmst = Time(datetime.now(tz), format = 'datetime', scale='utc')
-            siderealTime = observer.sidereal_time()
-            lha = (siderealTime * RAD_TO_DEG_FACTOR - (pointing[1]))%360
-            sunHourAngle = (Angle(lmst.sidereal_time('apparent', loc)).degree - (float(sun.ra) * RAD_TO_DEG_FACTOR))%360
-            
-            if sun.alt > 0:
-                # Moves ra stepper to track the sun
-                if sunHourAngle < lha - DEG_PER_STEP and lha - sunHourAngle < 180:
-                    # absoluteStepperState = moveStepper(0, 1, 1, absoluteStepperState)
-                    # pointing[1] += DEG_PER_STEP
-                    goto(sun.ra * RAD_TO_DEG_FACTOR, True)
-                    if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
-                        printAllCoords(sunHourAngle, lha)
-                        lastPrint = timenow
-                elif sunHourAngle > lha + DEG_PER_STEP and sunHourAngle - lha < 180:
-                    # absoluteStepperState = moveStepper(0, 1, -1, absoluteStepperState)
-                    # pointing[1] -= DEG_PER_STEP
-                    goto(sun.ra * RAD_TO_DEG_FACTOR, True)
-                    if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
-                        printAllCoords(sunHourAngle, lha)
-                        lastPrint = timenow
-                elif sunHourAngle < lha - DEG_PER_STEP and lha - sunHourAngle > 180:
-                    # absoluteStepperState = moveStepper(0, 1, -1, absoluteStepperState)
-                    # pointing[1] -= DEG_PER_STEP
-                    goto(sun.ra * RAD_TO_DEG_FACTOR, True)
-                    if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
-                        printAllCoords(sunHourAngle, lha)
-                        lastPrint = timenow
-                elif sunHourAngle > lha + DEG_PER_STEP and sunHourAngle - lha > 180:
-                    # absoluteStepperState = moveStepper(0, 1, 1, absoluteStepperState)
-                    # pointing[1] += DEG_PER_STEP
-                    goto(sun.ra * RAD_TO_DEG_FACTOR, True)
-                    if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
-                        printAllCoords(sunHourAngle, lha)
-                        lastPrint = timenow
-            cleanup(tmc1)
-            if timenow.timestamp() > obsEndTime.timestamp():
-                    home()
-                    trackSun()
-            
-            time.sleep(1)
-            
-            
+        if TRACKING_MODE == 'plan':
+            runPlan()
+        else:
+            while True:
+                autoStep()
     except KeyboardInterrupt:
         # goes back to main menu
+        setAutoState(automode.IDLE)
         cleanup(tmc1)
+
+def autoStep():
+    '''
+    one pass of the auto mode, moves to the next state on the way to what the schedule wants or, when there,
+    runs the current state: a tracking step, or a sleep until the next event
+    '''
+    global sunPos
+    global trackUntil
+
+    timenow = clock.now(tz)
+    if autoState == automode.TRACK and timenow < trackUntil:
+        goal = automode.TRACK
+    else:
+        goal = automode.wanted(schedule, timenow)
+    nextState = automode.nextState(autoState, goal)
+
+    if nextState != autoState:
+        setAutoState(nextState)
+        if nextState == automode.HOME:
+            home()
+        elif nextState == automode.SLEW:
+            sunPos = sunEphemeris.at(clock.now(tz))
+            goto(sunPos.ra, True, sunPos.dec)
+        elif nextState == automode.OVS:
+            gotoZenith()
+        elif nextState == automode.TRACK:
+            trackUntil = schedule.next(timenow, automode.TRACK_END_EVENTS).time
         return
 
+    if autoState == automode.TRACK:
+        if TRACKING_MODE == 'rate':
+            trackSunRate(trackUntil)
+        else:
+            trackSunOnce()
+            clock.sleep(1)
+    elif autoState == automode.OVS:
+        sleepUntil(schedule.next(timenow, (OVS_END,)).time)
+    else:
+        event = schedule.next(timenow, automode.WAKE_EVENTS)
+        print(f'{timenow}: sleeping until {event.kind} at {event.time}')
+        sleepUntil(event.time)
+
+def setAutoState(newState):
+    '''
+    switches the auto mode to newState and publishes it, the RA driver stays enabled at hold current while tracking
+    '''
+    global autoState
+    if newState == autoState:
+        return
+    if autoState == automode.TRACK:
+        tmc1.release()
+    if newState == automode.TRACK:
+        tmc1.hold()
+    print(f'{clock.now(tz)}: {autoState} -> {newState}')
+    AUTO_STATE.labels(autoState).set(0)
+    AUTO_STATE.labels(newState).set(1)
+    autoState = newState
+    state.publish(autoState=autoState, autoStateSince=clock.time())
+
+def trackSunOnce():
+    '''
+    one pass of the polling tracking loop, corrects both axes when the sun has moved to another step
+    '''
+    global pointing
+    global lastPrint
+    global sunPos
+
+    iterationStart = perf_counter()
+    # Update time and sun coords
+    timenow = clock.now(tz)
+    sunPos = sunEphemeris.at(timenow)
+    
+    # Pointing follows from the stepper positions and the sidereal time
+    updatePointing(timenow)
+
+    # Moves the steppers to track the sun once the sun is nearer to another step than to the current one
+    # (or to the end of the travel while the sun is out of reach)
+    raTarget = hourAngleToRaSteps(sunPos.ha, absoluteStepperState[0])
+    slew = planSlew(absoluteStepperState, raTarget, decToDecSteps(sunPos.dec), clip=True)
+    if sunPos.alt > 0 and (slew.raSteps != 0 or slew.decSteps != 0):
+        goto(sunPos.ra, True, sunPos.dec)
+        if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
+            siderealTime = localSiderealTime(timenow.timestamp())
+            recordCoords((siderealTime - sunPos.ra)%360, raStepsToHourAngle(absoluteStepperState[0]))
+            lastPrint = timenow
+    LOOP_SECONDS.labels('trackSun').observe(perf_counter() - iterationStart)
+    return timenow
+
+def trackSunRate(obsEndTime):
+    '''
+    tracks the sun by stepping the RA axis on a fixed schedule instead of polling the pointing error.
+    The step rate follows the hour angle rate of the sun (earth rotation minus the solar drift in RA) and is
+    corrected every TRACKING_CORRECTION_INTERVAL seconds from the ephemeris. The steps are phase aligned, each one
+    is due when the sun crosses the half step ahead of the antenna. The Dec axis follows the sun at the corrections.
+    Returns at obsEndTime.
+    '''
+    global pointing
+    global lastPrint
+    global sunPos
+
+    stepPeriod = None
+    nextStep = clock.time()
+    nextCorrection = clock.time()
+    ovs = schedule.next(clock.now(tz), (OVS_START,))
+
+    # the loop iteration is the work between two sleeps, the RA driver stays enabled at hold current in between
+    iterationStart = perf_counter()
+    tmc1.hold()
+    try:
+        while clock.time() < obsEndTime.timestamp():
+            now = clock.time()
+            if now >= ovs.time.timestamp():
+                observeOvs()
+                ovs = schedule.next(clock.now(tz), (OVS_START,))
+                nextCorrection = clock.time()
+                continue
+            if now >= nextCorrection:
+                timenow = clock.now(tz)
+                sunPos = sunEphemeris.at(timenow)
+                updatePointing(timenow)
+
+                siderealTime = localSiderealTime(now)
+                lha = raStepsToHourAngle(absoluteStepperState[0])
+                sunHourAngle = (siderealTime - sunPos.ra)%360
+
+                # positive when the antenna lags behind the sun
+                error = (sunHourAngle - lha + 180)%360 - 180
+                if abs(error) > TRACKING_MAX_RATE_ERROR * DEG_PER_STEP:
+                    goto(sunPos.ra, True, sunPos.dec)
+                    raTarget = hourAngleToRaSteps(sunHourAngle, absoluteStepperState[0])
+                    if not planSlew(absoluteStepperState, raTarget, decToDecSteps(sunPos.dec), clip=True).clipped:
+                        continue
+                    # the sun is out of reach, the antenna waits at the end of the travel until the next correction
+                    stepPeriod = None
+                else:
+                    # error in steps, whole steps behind (or ahead) are made up at once, within the travel,
+                    # together with the slow drift of the sun in declination
+                    lag = error * STEPS_PER_DEG
+                    catchUp = planSlew(absoluteStepperState, absoluteStepperState[0] - math.floor(lag + 0.5),
+                                       decToDecSteps(sunPos.dec), clip=True)
+                    if catchUp.raSteps != 0 or catchUp.decSteps != 0:
+                        moveAxes(catchUp.raSteps, catchUp.decSteps)
+                        lag += catchUp.raSteps
+                    # hour angle rate of the sun from the ephemeris, the next step is due when the sun crosses the
+                    # half step ahead of the antenna (-0.5 <= lag < 0.5)
+                    later = sunEphemeris.at(now + TRACKING_CORRECTION_INTERVAL)
+                    haRate = ((later.ha - sunPos.ha + 180)%360 - 180) / TRACKING_CORRECTION_INTERVAL
+                    stepRate = haRate * STEPS_PER_DEG
+                    stepPeriod = 1 / stepRate if stepRate > 0 else None
+                    if stepPeriod is not None:
+                        nextStep = now + (0.5 - lag) * stepPeriod
+                # no steps while the sun is down, it is checked again every second like the polling loop does
+                nextCorrection = now + (TRACKING_CORRECTION_INTERVAL if sunPos.alt > 0 else 1)
+
+                if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
+                    recordCoords(sunHourAngle, lha)
+                    lastPrint = timenow
+
+            if sunPos.alt <= 0 or stepPeriod is None:
+                LOOP_SECONDS.labels('trackSun').observe(perf_counter() - iterationStart)
+                clock.sleep(max(0, min(nextCorrection, ovs.time.timestamp()) - clock.time()))
+                iterationStart = perf_counter()
+                continue
+
+            # sleep exactly until the next step, rate correction or OVS is due
+            LOOP_SECONDS.labels('trackSun').observe(perf_counter() - iterationStart)
+            clock.sleep(max(0, min(nextStep, nextCorrection, ovs.time.timestamp()) - clock.time()))
+            iterationStart = perf_counter()
+            if clock.time() >= nextStep:
+                # increasing hour angle means decreasing RA
+                moveRa(-1)
+                nextStep += stepPeriod
+    finally:
+        tmc1.release()
+    cleanup(tmc1)
+
 def home():
     '''
     drives the antenna to the home position
@@ -150,27 +344,41 @@ def home():
     try:
         global pointing
         global observer
-        global sun
-        global loc
         global absoluteStepperState
+        global homed
         global ser
         
-        # drives RA axis towards home position
+        # not homed until the sensor is reached again
+        homed = False
+        journal.record(HA_HOME_ABS_POSITION, absoluteStepperState[1], raStepsToRa(HA_HOME_ABS_POSITION, clock.time()),
+                       decStepsToDec(absoluteStepperState[1]), MOVING, homed, sync=True)
+
+        # drives RA axis towards home position, fast until the limit sensor triggers
         print('homing RA...')
-        while g.input(38):
-            absoluteStepperState = moveStepper(tmc1, 1)
-            time.sleep(SLEEP_TIME)
+        homingStart = clock.time()
+        if backend.readLimit(LIMIT_PIN) and not runToLimit(tmc1, backend, LIMIT_PIN, STEPS_PER_ROT, HOME_TIMEOUT):
+            raise TimeoutError(f'limit sensor not reached within {HOME_TIMEOUT} s')
         print('end stop reached')
-        
-        timenow = datetime.now(tz)
-        sun.compute(observer)
+
+        # backs off and approaches again slowly, so the antenna always stops at the same edge of the sensor
+        moveStepper(tmc1, -HOME_BACKOFF_STEPS)
+        if not backend.readLimit(LIMIT_PIN):
+            raise RuntimeError(f'limit sensor still triggered after backing off {HOME_BACKOFF_STEPS} steps')
+        reached = runToLimit(tmc1, backend, LIMIT_PIN, 2 * HOME_BACKOFF_STEPS, HOME_TIMEOUT, speed=HOME_SLOW_SPEED)
+        if not reached:
+            raise TimeoutError(f'limit sensor not reached again within {2 * HOME_BACKOFF_STEPS} steps')
+        homingDuration = clock.time() - homingStart
+
+        timenow = clock.now(tz)
 
         # sets RA in home position
         absoluteStepperState[0] = HA_HOME_ABS_POSITION
-        siderealTime = observer.sidereal_time()
-        pointing[1] = (siderealTime * RAD_TO_DEG_FACTOR - HOME_HA)%360
-        pointing[0] = timenow
-        print('RA homed!')
+        updatePointing(timenow)
+        homed = True
+        journal.record(absoluteStepperState[0], absoluteStepperState[1], pointing[1], pointing[2], sync=True)
+        print(f'RA homed in {homingDuration:.1f} s!')
+        state.publish(time=pointing[0].timestamp(), ra=pointing[1], absoluteStepperState=list(absoluteStepperState),
+                      homed=True)
         
         cleanup(tmc1)
         coords()
@@ -179,116 +387,292 @@ def home():
         cleanup(tmc1)
         return
         
-def goto(targetRa, tracking):
+def goto(targetRa, tracking, targetDec=None):
     '''
-    goes to a given RA-Dec
+    goes to a given RA, and Dec if given, the whole slew is done as one accelerated move of both axes.
+    The target is converted to absolute step positions, a second pass picks up the earth rotation during the slew.
+    slew.planSlew keeps the slew within the travel of the mount: while tracking, targets out of reach are replaced
+    by the nearest end of the travel, otherwise the slew is refused and None returned
     '''
     try:
         global pointing
         global observer
-        global sun
-        global loc
         global lastPrint
         global absoluteStepperState
+        global sunPos
         
-        while True:
-            
-            # Update PyEphem variables: time, sun coords
-            timenow = datetime.now(tz)
-            observer.date = timenow
-            sun.compute(observer)
-            
-            # Update antenna pointing due to earth rotation
-            pointing[1] += (timenow - pointing[0]).total_seconds() * DEG_PER_SECOND
-            pointing[0] = timenow
-
-            # Compute local hour angle of the pointing
-            lmst = Time(datetime.now(tz), format = 'datetime', scale='utc')
-            siderealTime = observer.sidereal_time()
-            lha = (siderealTime * RAD_TO_DEG_FACTOR - (pointing[1]))%360
-            sunHourAngle = (Angle(lmst.sidereal_time('apparent', loc)).degree - (float(sun.ra) * RAD_TO_DEG_FACTOR))%360
-
-            # Moves ra stepper to go-to/track the target
-            if targetRa < pointing[1] - DEG_PER_STEP and pointing[1] - targetRa < 180:
-                while targetRa < pointing[1]:
-                    absoluteStepperState = moveStepper(tmc1, -1)
-                    pointing[0] = timenow
-                    pointing[1] -= DEG_PER_STEP
-                    if pointing[1] < 0:
-                        pointing[1] = 360 + pointing[1]
-                    timenow = datetime.now(tz)
-                    if tracking:
-                        if abs(pointing[1] - targetRa) < 0.01:
-                            return
-                    if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
-                        printAllCoords(sunHourAngle, lha)
-                        lastPrint = timenow
-
-            elif targetRa > pointing[1] + DEG_PER_STEP and targetRa - pointing[1] < 180:
-                while targetRa > pointing[1]:
-                    absoluteStepperState = moveStepper(tmc1, 1)
-                    pointing[0] = timenow
-                    pointing[1] += DEG_PER_STEP
-                    if pointing[1] > 360:
-                        pointing[1] = pointing[1] - 360
-                    timenow = datetime.now(tz)
-                    if tracking:
-                        if abs(targetRa - pointing[1]) < 0.01:
-                            return
-                    if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
-                        printAllCoords(sunHourAngle, lha)
-                        lastPrint = timenow
+        gotoStart = perf_counter()
+        # one enable per goto, not per pass
+        with motionBatch(tmc1, tmc2):
+            while True:
             
-            elif targetRa < pointing[1] - DEG_PER_STEP and pointing[1] - targetRa > 180:
-                while targetRa < pointing[1]:
-                    absoluteStepperState = moveStepper(tmc1, 1)
-                    pointing[0] = timenow
-                    pointing[1] += DEG_PER_STEP
-                    if pointing[1] > 360:
-                        pointing[1] = pointing[1] - 360
-                    timenow = datetime.now(tz)
-                    if tracking:
-                        if abs(targetRa - pointing[1]) < 0.01:
-                            return
-                    if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
-                        printAllCoords(sunHourAngle, lha)
-                        lastPrint = timenow
-                        
-            elif targetRa > pointing[1] + DEG_PER_STEP and targetRa - pointing[1] > 180:
-                while targetRa > pointing[1]:
-                    absoluteStepperState = moveStepper(tmc1, -1)
-                    pointing[0] = timenow
-                    pointing[1] -= DEG_PER_STEP
-                    if pointing[1] < 0:
-                        pointing[1] = 360 + pointing[1]
-                    timenow = datetime.now(tz)
-                    if tracking:
-                        if abs(pointing[1] - targetRa) < 0.01:
-                            return
-                    if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
-                        printAllCoords(sunHourAngle, lha)
-                        lastPrint = timenow
+                # Update time and sun coords
+                timenow = clock.now(tz)
+                sunPos = sunEphemeris.at(timenow)
 
-            cleanup(tmc1)
+                # Fastest legal way to the target in steps, positive steps increase the RA
+                slew = planSlew(absoluteStepperState, raToRaSteps(targetRa, timenow.timestamp(), absoluteStepperState[0]),
+                                decToDecSteps(targetDec) if targetDec is not None else None, tracking,
+                                fullstepSpeed(MICROSTEPS) * MICROSTEPS, MAX_ACCEL * MICROSTEPS)
+                if slew.raSteps == 0 and slew.decSteps == 0:
+                    break
 
+                if not tracking:
+                    print(f'{timenow}: slewing {slew.raSteps} RA steps, {slew.decSteps} Dec steps, '
+                          f'about {slew.duration:.1f} s')
+                state.publish(slewDuration=slew.duration, slewEnd=timenow.timestamp() + slew.duration)
+                moveAxes(slew.raSteps, slew.decSteps)
+                updatePointing(timenow)
+
+                if (timenow - lastPrint).total_seconds() >= PRINT_FREQ:
+                    siderealTime = localSiderealTime(timenow.timestamp())
+                    recordCoords((siderealTime - sunPos.ra)%360, (siderealTime - pointing[1])%360)
+                    lastPrint = timenow
+
+        cleanup(tmc1)
+        updatePointing(clock.now(tz))
+        state.publish(time=pointing[0].timestamp(), ra=pointing[1], dec=pointing[2])
+        LOOP_SECONDS.labels('goto').observe(perf_counter() - gotoStart)
+        return pointing[1]
+
+    except SlewLimitError as e:
+        print(f'goto refused: {e}')
+        state.publish(lastError=str(e))
+        return None
     except KeyboardInterrupt:
         cleanup(tmc1)
         return pointing[1]
 
+def trackTargetOnce(target):
+    '''
+    one pass of the polling tracking loop for any target, see targets.py.
+    Corrects both axes when the target has moved to another step and is above the horizon
+    '''
+    global pointing
+
+    timenow = clock.now(tz)
+    position = target.at(timenow)
+    updatePointing(timenow)
+
+    raSteps = hourAngleToRaSteps(position.ha, absoluteStepperState[0])
+    if position.alt > 0 and (raSteps, decToDecSteps(position.dec)) != tuple(absoluteStepperState):
+        goto(position.ra, True, position.dec)
+    state.publish(target=target.name, targetRa=position.ra, targetDec=position.dec, targetAlt=position.alt)
+    return timenow
+
+def trackTarget(name, until=None):
+    '''
+    tracks a target by name (see targets.TargetRegistry.get) until the given datetime or until interrupted
+    '''
+    try:
+        target = targets.get(name)
+        position = target.at(clock.now(tz))
+        if position.alt <= 0:
+            print(f'{target.name} is below the horizon (alt {position.alt:.1f} deg)')
+            return
+        if goto(position.ra, False, position.dec) is None:
+            return
+        print(f'tracking {target.name}')
+        # both drivers stay enabled at hold current between the tracking corrections
+        with motionBatch(tmc1, tmc2):
+            while until is None or clock.now(tz) < until:
+                trackTargetOnce(target)
+                clock.sleep(1)
+    except ValueError as e:
+        print(e)
+    except KeyboardInterrupt:
+        pass
+    cleanup(tmc1)
+    cleanup(tmc2)
+
+def runPlan():
+    '''
+    plays back the compiled plan of every day (see planner.py), the plan is built before the first row of the day.
+    The drivers stay enabled only within the tracking intervals of the plan, the auto state is TRACK within them
+    and WAIT in between
+    '''
+    while True:
+        today = clock.now(tz).date()
+        plan = getPlan(today, tz)
+        print(f'{clock.now(tz)}: executing the plan of {today} ({len(plan)} rows)')
+        executor = PlanExecutor(plan, moveTo, home, clock)
+        intervals = [(start, end) for start, end in trackingIntervals(plan) if end > clock.time()]
+        for start, end in intervals:
+            setAutoState(automode.WAIT)
+            executor.run(start)
+            setAutoState(automode.TRACK)
+            with motionBatch(tmc1, tmc2):
+                executor.run(end)
+        setAutoState(automode.WAIT)
+        executor.run()
+        print(f'{clock.now(tz)}: plan done, {executor.executed} rows, max lateness {executor.maxLateness:.3f} s')
+        cleanup(tmc1)
+        cleanup(tmc2)
+        # the next plan starts at local midnight
+        sleepUntil(tz.localize(datetime.combine(today + timedelta(days=1), datetime.min.time())))
+
+def runScan(kind, extent, spacing, dwell=None):
+    '''
+    raster or drift scan around the sun (see scans.py), precomputed from the current position and executed as moves
+    at the planned times within one motion batch. Every dwell goes to the dwell log, its path is returned (None if
+    the scan was refused)
+    '''
+    try:
+        trajectory = buildTrajectory(kind, sunEphemeris, absoluteStepperState, clock.time(), extent, spacing, dwell,
+                                     fullstepSpeed(MICROSTEPS) * MICROSTEPS, MAX_ACCEL * MICROSTEPS)
+    except ValueError as e:
+        # also a slew.SlewLimitError
+        print(f'scan refused: {e}')
+        return None
+    log = DwellLog(dwellLogPath(kind, trajectory['move'][0]))
+    print(f'{clock.now(tz)}: {kind} scan, {len(trajectory)} dwells until '
+          f'{datetime.fromtimestamp(trajectory["end"][-1], tz)}, dwell log {log.path}')
+    try:
+        with motionBatch(tmc1, tmc2):
+            for i, row in enumerate(trajectory):
+                clock.sleep(max(0, row['move'] - clock.time()))
+                moveTo({RA_AXIS: int(row['ra']), DEC_AXIS: int(row['dec'])})
+                # the dwell starts once the antenna is there, not before its planned start
+                clock.sleep(max(0, row['start'] - clock.time()))
+                start = clock.time()
+                state.publish(scan=kind, scanDwell=i, scanDwells=len(trajectory))
+                clock.sleep(max(0, row['end'] - clock.time()))
+                log.record(i, row, start, clock.time())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.close()
+        state.publish(scan=None)
+    print(f'{clock.now(tz)}: scan done, {log.rows} of {len(trajectory)} dwells')
+    cleanup(tmc1)
+    cleanup(tmc2)
+    return log.path
+
+def moveTo(targets):
+    """ moves the axes to absolute stepper positions at the same time
+
+    Args:
+        targets (dict): absolute target position by axis, planner.RA_AXIS or planner.DEC_AXIS
+    """
+    global pointing
+    raSteps = targets.get(RA_AXIS, absoluteStepperState[0]) - absoluteStepperState[0]
+    decSteps = targets.get(DEC_AXIS, absoluteStepperState[1]) - absoluteStepperState[1]
+    moveAxes(raSteps, decSteps)
+    updatePointing(clock.now(tz))
+
+def moveRa(steps):
+    """ moves the RA axis as one accelerated move and keeps track of the absolute stepper position
+
+    Args:
+        steps (int): positive or negative number of steps, positive increases the RA
+    """
+    moveAxes(steps, 0)
+
+def moveAxes(raSteps, decSteps):
+    """ moves both axes at the same time, the move takes as long as the longer of the two.
+    Each axis keeps its own absolute stepper position. Slews run at MICROSTEPS, shorter moves (the tracking
+    steps) at TRACK_MICROSTEPS for a smoother motion, the positions stay in steps at MICROSTEPS
+
+    Args:
+        raSteps (int): positive or negative RA steps, positive increases the RA
+        decSteps (int): positive or negative Dec steps, positive increases the Dec
+
+    Raises:
+        SlewLimitError: once homed, for moves ending outside the travel of the mount
+        MoveInterrupted: on a KeyboardInterrupt, the positions are advanced by the steps made until then
+    """
+    global homed
+    if homed:
+        checkMove(absoluteStepperState, raSteps, decSteps)
+    if max(abs(raSteps), abs(decSteps)) > JOURNAL_SLEW_STEPS:
+        # a crash during a slew leaves the position unknown, the marker is on disk before the motors move
+        journal.record(absoluteStepperState[0] + raSteps, absoluteStepperState[1] + decSteps,
+                       raStepsToRa(absoluteStepperState[0] + raSteps, clock.time()),
+                       decStepsToDec(absoluteStepperState[1] + decSteps), MOVING, homed, sync=True)
+    microsteps = MICROSTEPS if max(abs(raSteps), abs(decSteps)) > SLEW_MIN_STEPS else TRACK_MICROSTEPS
+    moved = None
+    try:
+        if decSteps == 0:
+            moved = [moveStepper(tmc1, raSteps, microsteps), 0]
+        else:
+            moved = moveSteppers([(tmc1, raSteps), (tmc2, decSteps)], microsteps)
+    except MoveInterrupted as interrupt:
+        moved = [interrupt.steps, 0] if decSteps == 0 else interrupt.steps
+        raise
+    finally:
+        if moved is None:
+            # the move failed without telling how far it got, the position is not trusted until homed again
+            homed = False
+            moved = [0, 0]
+        for axis, steps in (('ra', moved[0]), ('dec', moved[1])):
+            if steps != 0:
+                STEPS.labels(axis).inc(abs(steps))
+        absoluteStepperState[0] += moved[0]
+        absoluteStepperState[1] += moved[1]
+        state.publish(absoluteStepperState=list(absoluteStepperState), homed=homed)
+        journal.record(absoluteStepperState[0], absoluteStepperState[1],
+                       raStepsToRa(absoluteStepperState[0], clock.time()), decStepsToDec(absoluteStepperState[1]),
+                       IDLE, homed)
+
+def updatePointing(timenow):
+    """ derives pointing from the absolute stepper positions, the only place where the angles are computed
+
+    Args:
+        timenow (datetime): time of the pointing, the RA follows the sidereal time while the axis stands still
+    """
+    global pointing
+    pointing[0] = timenow
+    pointing[1] = raStepsToRa(absoluteStepperState[0], timenow.timestamp())
+    pointing[2] = decStepsToDec(absoluteStepperState[1])
+
+def restorePosition():
+    """ replays the position journal to restart without homing
+
+    Returns:
+        bool: whether the position was restored, homing is required otherwise
+    """
+    global pointing
+    global absoluteStepperState
+    global homed
+
+    record = replay(journal.path)
+    # the journal is stamped with the wall clock, whatever clock the routines run on
+    restored, reason = restoreDecision(record, time.time())
+    if not restored:
+        print(f'position journal not usable ({reason}), homing required')
+        return False
+    absoluteStepperState[0] = record.raSteps
+    absoluteStepperState[1] = record.decSteps
+    updatePointing(clock.now(tz))
+    homed = True
+    print(f'position {reason}')
+    coords()
+    return True
+
+def park():
+    '''
+    parks the antenna at the home position and releases both motors
+    '''
+    setAutoState(automode.PARK)
+    home()
+    cleanup(tmc1)
+    cleanup(tmc2)
+    setAutoState(automode.IDLE)
+
 def gotoZenith():
     '''
     goes to zenith assuming antenna is at home position
     '''
     global absoluteStepperState
-    now = datetime.utcnow()
+    now = clock.now(timezone.utc)
     print(f'{now}going to zenith, this will take approx. 3min')
     zenithSteps = STEPS_PER_ROT / 4
-    absoluteStepperState = moveStepper(tmc1, -int(zenithSteps))
-    now = datetime.utcnow()
+    moveRa(-int(zenithSteps))
+    now = clock.now(timezone.utc)
     print(f'arrived at zenith at {now}(UTC)')
     
 def manual(raSteps, decSteps):
-    """ manually moves the two axes by the specified amount of steps
+    """ manually moves the two axes by the specified amount of steps, both axes move at the same time
 
     Args:
         raSteps (int): positive or negative hour axis steps
@@ -297,110 +681,82 @@ def manual(raSteps, decSteps):
     try:
         global pointing
         global observer
-        global sun
-        global loc
         global lastPrint
         global absoluteStepperState
 
-        if raSteps < 0:
-            try:
-                print(f'brrrrrrrrrrrrrrrrrrrrr {absoluteStepperState}')
-                moveStepper(tmc1, -raSteps)
-            except KeyboardInterrupt:
-                cleanup(tmc1)
-                return
-        if raSteps > 0:
-            try:
-                print('brrrrrrrrrrrrrrrrrrrrr')
-                moveStepper(tmc1, raSteps)
-            except KeyboardInterrupt:
-                cleanup(tmc1)
-                return
-
-        if decSteps < 0:
-            try:
-                print('brrrrrrrrrrrrrrrrrrrrr')
-                moveStepper(tmc1, -decSteps)
-            except KeyboardInterrupt:
-                cleanup(tmc1)
-                return
-        if decSteps > 0:
-            try:
-                print('brrrrrrrrrrrrrrrrrrrrr')
-                moveStepper(tmc1, decSteps)
-            except KeyboardInterrupt:
-                cleanup(tmc1)
-                return
+        print(f'brrrrrrrrrrrrrrrrrrrrr {absoluteStepperState}')
+        moveAxes(raSteps, decSteps)
+        updatePointing(clock.now(tz))
+        state.publish(ra=pointing[1], dec=pointing[2])
+    except SlewLimitError as e:
+        print(f'manual move refused: {e}')
     except KeyboardInterrupt:
         cleanup(tmc1)
+        cleanup(tmc2)
         return
     
 def coords():
     '''
-    prints out current pointing of the antenna along with the sun coordinates
+    prints out current pointing of the antenna along with the sun coordinates and records them to the telemetry
     '''
     global pointing
     global observer
-    global sun
-    global loc
     global lastPrint
     global absoluteStepperState
+    global sunPos
 
-    # Update PyEphem variables: time, sun coords
-    timenow = datetime.now(tz)
-    observer.date = timenow
-    sun.compute(observer)
-
-    # Update antenna pointing due to earth rotation
-    pointing[1] += (timenow - pointing[0]).total_seconds() * DEG_PER_SECOND
-    pointing[0] = timenow
+    # Update time and sun coords
+    timenow = clock.now(tz)
+    sunPos = sunEphemeris.at(timenow)
+    updatePointing(timenow)
 
     # Compute local hour angle of the pointing
-    siderealTime = observer.sidereal_time()
-    lha = (siderealTime * RAD_TO_DEG_FACTOR - (pointing[1]))%360
-    sunHourAngle = (siderealTime - (float(sun.ra) * RAD_TO_DEG_FACTOR))%360
+    siderealTime = localSiderealTime(timenow.timestamp())
+    lha = raStepsToHourAngle(absoluteStepperState[0])
+    sunHourAngle = (siderealTime - sunPos.ra)%360
 
-    printAllCoords(sunHourAngle, lha)
+    recordCoords(sunHourAngle, lha)
+    print(f'{pointing[0]} | {sunPos.ra}, {sunPos.dec}, {sunHourAngle} | {round(pointing[1], 9)}, {round(pointing[2], 9)} {round(lha, 9)} | {absoluteStepperState}')
 
-def printAllCoords(sunHourAngle, lha):
-    print(f'{pointing[0]} | {float(sun.ra) * RAD_TO_DEG_FACTOR}, {float(sun.dec) * RAD_TO_DEG_FACTOR}, {sunHourAngle} | {round(pointing[1], 9)}, {round(pointing[2], 9)} {round(lha, 9)} | {absoluteStepperState}')
-    
-def waitForSunrise():
-    print('Waiting for sunrise')
-    while True:
-        observer.date = datetime.now(tz)
-        sun.compute(observer)
-        if sun.alt > 0:
-            print('Good morning world')
-            break
-        time.sleep(30)
-    return
+def recordCoords(sunHourAngle, lha):
+    """ appends the current sun coordinates, antenna pointing and stepper state to the telemetry
 
-def waitForSchedule():
-    print('Waiting for next scheduled event')
+    Args:
+        sunHourAngle (float): hour angle of the sun in degrees
+        lha (float): local hour angle of the antenna pointing in degrees
+    """
+    POINTING_ERROR.set((lha - sunHourAngle + 180)%360 - 180)
+    state.publish(time=pointing[0].timestamp(), sunRa=sunPos.ra, sunDec=sunPos.dec, sunHa=sunHourAngle,
+                  ra=pointing[1], dec=pointing[2], lha=lha, absoluteStepperState=list(absoluteStepperState))
+    telemetry.record(pointing[0].timestamp(), sunPos.ra, sunPos.dec, sunHourAngle, pointing[1], pointing[2], lha,
+                     absoluteStepperState[0], absoluteStepperState[1])
+    
+def sleepUntil(t):
+    '''
+    sleeps until the given timezone aware datetime
+    '''
+    clock.sleep(max(0, t.timestamp() - clock.time()))
 
-    while True:
-        starttime = datetime.now(tz).replace(hour=START_TIME_HOUR, minute=START_TIME_MINUTE, second=0, microsecond=0)
-        ovstime = datetime.now(tz).replace(hour=OVS_TIMEH, minute=OVS_TIMEM, second=0, microsecond=0)
-        obsEndTime = datetime.now().replace(hour=STOP_TIME_HOUR, minute=STOP_TIME_MINUTE, second=0, microsecond=0)
-        timenow = datetime.now(tz)
-        observer.date = timenow
-        sun.compute(observer)
-        if timenow >= (starttime + timedelta(hours=-1)) and timenow.timestamp() <= (obsEndTime).timestamp():
-            print(f'{timenow}: good morning world')
-            break
-        if timenow > ovstime + timedelta(minutes=-15) and timenow < ovstime + timedelta(minutes=15):
-            gotoZenith()
-            time.sleep(1800)
-            print(f'{timenow}: going back home')
-            home()
-        time.sleep(30)
-    return
+def observeOvs():
+    '''
+    points the antenna to zenith for the spectral overview that is due now and goes back home at the end of the slot
+    '''
+    end = schedule.next(clock.now(tz), (OVS_END,))
+    print(f'{clock.now(tz)}: spectral overview until {end.time}')
+    if absoluteStepperState[0] != HA_HOME_ABS_POSITION:
+        home()
+    gotoZenith()
+    sleepUntil(end.time)
+    print(f'{clock.now(tz)}: going back home')
+    home()
 # ===== Main loop manual control =====
 if __name__ == '__main__':
+    init()
+    restorePosition()
     try:
         while True:
             cleanup(tmc1)
+            cleanup(tmc2)
             continuation = input(MENU_STRING)
             if continuation == 't':
                 trackSun()
@@ -411,16 +767,24 @@ if __name__ == '__main__':
                 ra = float(input('target RA (in deg): '))
                 print(ra)
                 goto(ra, False)
+            elif continuation == 'target':
+                trackTarget(input(TARGET_PROMPT))
             elif continuation == 'm':
                 raSteps = int(input('RA steps: '))
                 decSteps = int(input('DEC steps: '))
-                moveStepper(tmc1, raSteps)
-                # manual(raSteps, decSteps)
+                manual(raSteps, decSteps)
                 print('Done!')
+            elif continuation == 'scan':
+                kind = input('scan (raster or drift): ')
+                extent = float(input('extent (in deg): '))
+                spacing = float(input('spacing (in deg): '))
+                dwell = input('dwell time (in s, empty for the drift time): ')
+                runScan(kind, extent, spacing, float(dwell) if dwell else None)
             elif continuation == 'coords':
                 coords()
             elif continuation == 'clean':
                 cleanup(tmc1)
+                cleanup(tmc2)
             else:
                 confirmation = input('Are you sure about that? [y/n]\n>>> ')
                 if confirmation == 'y':
@@ -428,20 +792,25 @@ if __name__ == '__main__':
                 else:
                     continue
     except KeyboardInterrupt:
-        fWrite = open('lastPos.txt', 'w')
-        fWrite.write(f'{pointing[1]} {pointing[2]} {absoluteStepperState[0]}')
-        fWrite.close()
+        journal.close()
+        telemetry.close()
         tmc1.set_motor_enabled(False)
+        tmc2.set_motor_enabled(False)
         del tmc1
+        del tmc2
 
 # ===== Main loop auto control =====
 # if __name__ == '__main__':
+#     init()
 #     try:
-#         cleanup(motors)
-#         home()
+#         cleanup(tmc1)
+#         cleanup(tmc2)
+#         if not restorePosition():
+#             home()
 #         trackSun()
+#         # the auto mode was interrupted, the antenna is parked before the process ends
+#         park()
             
 #     except KeyboardInterrupt:
-#         fWrite = open('lastPos.txt', 'w')
-#         fWrite.write(f'{pointing[1]} {pointing[2]} {absoluteStepperState[0]}')
-#         fWrite.close()
+#         journal.close()
+#         telemetry.close()
@@ -0,0 +1,204 @@
+"""
+Control loop health metrics in the Prometheus text format
+
+The metrics are plain counters, gauges and histograms updated in place, an update
+is a few attribute operations so they can sit on the step path. serve() exposes
+them on http://METRICS_HOST:METRICS_PORT/metrics from a daemon thread.
+
+    ecallisto_loop_seconds{loop}                    duration of a tracking loop iteration or goto call
+    ecallisto_steps_total{axis}                     steps issued per axis
+    ecallisto_ephemeris_seconds                     time spent looking up the sun position
+    ecallisto_sidereal_seconds                      time spent computing the local sidereal time
+    ecallisto_pointing_error_degrees                antenna minus sun hour angle
+    ecallisto_driver_enabled_seconds_total{axis}    time the motor drivers were enabled, from enable to disable
+    ecallisto_driver_transactions_total{axis,kind}  register and enable pin writes sent to the drivers
+    ecallisto_step_lateness_seconds{axis}           latest step of every move of a step worker
+    ecallisto_step_deadline_misses_total{axis}      steps later than STEP_DEADLINE_TOLERANCE
+    ecallisto_auto_state{state}                     1 for the current state of the auto mode, 0 for the others
+"""
+
+import bisect
+import functools
+import threading
+from time import perf_counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from constants import *
+
+# Histogram buckets (in seconds) for loop iterations and for single calculations
+LOOP_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300)
+CALL_BUCKETS = (0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01)
+STEP_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.05)
+
+registry = []
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # the bucket of the smallest upper bound >= value, the last one is +Inf
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            samples.append((f'{name}_bucket', labels + (('le', le),), cumulative))
+        samples.append((f'{name}_sum', labels, self.sum))
+        samples.append((f'{name}_count', labels, self.count))
+        return samples
+
+
+class Family:
+    """ a metric with its label names, labels() returns the child holding the value of one label set.
+    Metrics without labels forward inc/set/observe to their single child
+    """
+
+    def __init__(self, name, help, kind, labelNames=(), buckets=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelNames = labelNames
+        self.buckets = buckets
+        self.children = {}
+        self.lock = threading.Lock()
+        if not labelNames:
+            self.child = self.labels()
+        registry.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.create())
+        return child
+
+    def create(self):
+        if self.kind == 'counter':
+            return Counter()
+        if self.kind == 'gauge':
+            return Gauge()
+        return Histogram(self.buckets)
+
+    def inc(self, amount=1):
+        self.child.inc(amount)
+
+    def set(self, value):
+        self.child.set(value)
+
+    def observe(self, value):
+        self.child.observe(value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for values, child in list(self.children.items()):
+            for name, labels, value in child.samples(self.name, tuple(zip(self.labelNames, values))):
+                labelText = ','.join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f'{name}{{{labelText}}} {value}' if labelText else f'{name} {value}')
+        return lines
+
+
+def render():
+    """ all metrics in the Prometheus text exposition format """
+    lines = []
+    for family in registry:
+        lines += family.render()
+    return '\n'.join(lines) + '\n'
+
+
+def timed(histogram):
+    """ decorator observing the duration of every call in histogram """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+        return wrapper
+
+    return decorator
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=METRICS_PORT, host=METRICS_HOST):
+    """ serves the metrics from a daemon thread
+
+    Returns:
+        ThreadingHTTPServer: the server, None if the port is not available
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f'metrics endpoint not started: {e}')
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+LOOP_SECONDS = Family('ecallisto_loop_seconds', 'Duration of one tracking loop iteration or goto call, without sleeps',
+                      'histogram', ('loop',), LOOP_BUCKETS)
+STEPS = Family('ecallisto_steps_total', 'Steps issued to the motor drivers', 'counter', ('axis',))
+EPHEMERIS_SECONDS = Family('ecallisto_ephemeris_seconds', 'Time spent looking up the sun position', 'histogram',
+                           buckets=CALL_BUCKETS)
+SIDEREAL_SECONDS = Family('ecallisto_sidereal_seconds', 'Time spent computing the local sidereal time', 'histogram',
+                          buckets=CALL_BUCKETS)
+POINTING_ERROR = Family('ecallisto_pointing_error_degrees', 'Antenna minus sun hour angle at the last record', 'gauge')
+DRIVER_ENABLED_SECONDS = Family('ecallisto_driver_enabled_seconds_total', 'Time the motor drivers were enabled',
+                                'counter', ('axis',))
+DRIVER_TRANSACTIONS = Family('ecallisto_driver_transactions_total', 'Register and enable pin writes sent to the drivers',
+                             'counter', ('axis', 'kind'))
+STEP_LATENESS = Family('ecallisto_step_lateness_seconds', 'Lateness of the latest step of every move of a step worker',
+                       'histogram', ('axis',), STEP_BUCKETS)
+STEP_DEADLINE_MISSES = Family('ecallisto_step_deadline_misses_total', 'Steps later than STEP_DEADLINE_TOLERANCE',
+                              'counter', ('axis',))
+AUTO_STATE = Family('ecallisto_auto_state', '1 for the current state of the auto mode, 0 for the others', 'gauge',
+                    ('state',))
@@ -0,0 +1,313 @@
+"""
+Whole-day observing plan compiled into a timestamped step schedule
+
+buildPlan() runs once per local day (before dawn) and turns the schedule of the day,
+the OVS slots, the home and zenith positions and the sun track into a structured
+array of PLAN_DTYPE rows (time, axis, kind, absolute step target), sorted by time.
+While tracking there is one row per step, at the time the rounded step position of
+the sun changes. PlanExecutor plays a plan back, per row it only compares the clock
+with the row time. trackingIntervals() gives the parts of a plan in which the sun is
+tracked, from the slew onto the sun to the next home or zenith row.
+
+Plans are saved in PLAN_DIR as plan_YYYYMMDD.npy with a JSON file holding the hash
+of the site configuration they were built from, and a text dump for inspection and
+diffing. getPlan() rebuilds a plan when the configuration hash no longer matches.
+
+usage: python planner.py [YYYY-MM-DD] [--rebuild] [--dump] [--diff other.npy]
+"""
+
+import os
+import json
+import bisect
+import difflib
+import hashlib
+import ephem
+import constants
+from fractions import Fraction
+from datetime import datetime, timezone
+from constants import *
+from ephemeris import makeObserver, computeSun
+from position import hourAngleToRaSteps, raStepsToHourAngle, decToDecSteps, decStepsToDec
+from scheduler import dayEvents, START, STOP, OVS_START, OVS_END, SUNRISE, SUNSET
+
+# Bumped whenever the plan layout or the way plans are built changes
+PLAN_VERSION = 2
+
+# Axes
+RA_AXIS = 0
+DEC_AXIS = 1
+AXIS_NAMES = ('RA', 'DEC')
+
+# Row kinds
+TRACK = 0
+SLEW = 1
+HOME = 2
+ZENITH = 3
+KIND_NAMES = ('TRACK', 'SLEW', 'HOME', 'ZENITH')
+
+PLAN_DTYPE = [('time', '<f8'), ('axis', 'i1'), ('kind', 'i1'), ('target', '<i8')]
+
+# Constants a plan depends on, a change of any of them invalidates saved plans
+SITE_CONFIG = ('LAT', 'LON', 'ALTITUDE', 'STEPS_PER_ROT', 'STEPS_PER_DEG', 'HOME_HA', 'HA_HOME_ABS_POSITION',
+               'HOME_DEC', 'DEC_HOME_ABS_POSITION', 'START_TIME_HOUR', 'START_TIME_MINUTE', 'STOP_TIME_HOUR',
+               'STOP_TIME_MINUTE', 'OVS_TIMEH', 'OVS_TIMEM', 'OVS_HALF_WINDOW', 'START_LEAD_MINUTES', 'PLAN_STEP')
+
+
+def configHash():
+    """ hash of the site configuration and planner version the plans depend on """
+    config = {name: getattr(constants, name) for name in SITE_CONFIG}
+    config['version'] = PLAN_VERSION
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def raStepsForHourAngle(ha):
+    """ absolute RA stepper position pointing at the hour angle ha, see position.hourAngleToRaSteps
+
+    The axis turns from the home position (at the limit sensor) towards increasing hour angle, hour angles up to
+    90 degrees before HOME_HA are beyond the limit and stay at home
+    """
+    return min(hourAngleToRaSteps(ha, HA_HOME_ABS_POSITION - STEPS_PER_ROT // 4), HA_HOME_ABS_POSITION)
+
+
+def crossings(ts, angles, toSteps, toAngle):
+    """ times at which the step position of a sampled angle changes
+
+    Args:
+        ts (numpy.ndarray): sample times
+        angles (numpy.ndarray): angle in degrees at the sample times, linear in between
+        toSteps (callable): step position of an angle, e.g. position.decToDecSteps
+        toAngle (callable): angle of a step position, the inverse of toSteps, e.g. position.decStepsToDec
+
+    Returns:
+        tuple: (times, targets) lists, one entry per step, targets are the new step positions
+    """
+    steps = [toSteps(angle) for angle in angles]
+    times = []
+    targets = []
+    for i in range(len(steps) - 1):
+        if steps[i] == steps[i + 1]:
+            continue
+        a = angles[i]
+        b = a + (angles[i + 1] - a + 180)%360 - 180
+        direction = 1 if steps[i + 1] > steps[i] else -1
+        for level in range(steps[i] + direction, steps[i + 1] + direction, direction):
+            # the position changes to level where the angle crosses the half step before it
+            boundary = a + (toAngle(Fraction(2 * level - direction, 2)) - a + 180)%360 - 180
+            times.append(ts[i] + (boundary - a) / (b - a) * (ts[i + 1] - ts[i]))
+            targets.append(level)
+    return times, targets
+
+
+def buildPlan(day, tz, observer=None):
+    """ compiles the plan of one local day
+
+    Args:
+        day (date): local date
+        tz (pytz timezone): local timezone
+        observer (ephem.Observer): station observer, a new one if None
+
+    Returns:
+        numpy.ndarray: rows of PLAN_DTYPE sorted by time
+    """
+    import numpy as np
+    if observer is None:
+        observer = makeObserver()
+    events = dayEvents(day, tz, observer)
+    times = {kind: [event.time.timestamp() for event in events if event.kind == kind]
+             for kind in (START, STOP, OVS_START, OVS_END, SUNRISE, SUNSET)}
+    rows = []
+
+    def add(t, axis, kind, target):
+        rows.append((t, axis, kind, int(round(target))))
+
+    # spectral overviews: home, zenith, home at the end of the slot
+    slots = list(zip(times[OVS_START], times[OVS_END]))
+    for start, end in slots:
+        add(start, RA_AXIS, HOME, HA_HOME_ABS_POSITION)
+        add(start, RA_AXIS, ZENITH, HA_HOME_ABS_POSITION - STEPS_PER_ROT // 4)
+        add(end, RA_AXIS, HOME, HA_HOME_ABS_POSITION)
+
+    # sun tracking from the start (or sunrise) to the stop (or sunset), interrupted by the OVS slots
+    obsStart = max(times[START] + times[SUNRISE])
+    obsEnd = min(times[STOP] + times[SUNSET])
+    intervals = []
+    for start, end in sorted(slots):
+        if start > obsStart:
+            intervals.append((obsStart, min(start, obsEnd)))
+        obsStart = max(obsStart, end)
+    intervals.append((obsStart, obsEnd))
+    sun = ephem.Sun()
+    for start, end in intervals:
+        if end <= start:
+            continue
+        ts = np.append(np.arange(start, end, PLAN_STEP), end)
+        positions = np.array([computeSun(observer, sun, t) for t in ts])
+        for axis, angles, toSteps, toAngle in ((RA_AXIS, positions[:, 3], raStepsForHourAngle, raStepsToHourAngle),
+                                               (DEC_AXIS, positions[:, 1], decToDecSteps, decStepsToDec)):
+            add(start, axis, SLEW, toSteps(angles[0]))
+            for t, target in zip(*crossings(ts, angles, toSteps, toAngle)):
+                add(t, axis, TRACK, target)
+    if intervals[-1][1] > intervals[-1][0]:
+        add(obsEnd, RA_AXIS, HOME, HA_HOME_ABS_POSITION)
+
+    plan = np.array(rows, dtype=PLAN_DTYPE)
+    return plan[np.argsort(plan['time'], kind='stable')]
+
+
+def planPath(day, extension, directory=PLAN_DIR):
+    return os.path.join(directory, f'plan_{day:%Y%m%d}.{extension}')
+
+
+def dump(plan):
+    """ one text line per row: UTC time, axis, kind and step target """
+    return [f'{datetime.fromtimestamp(row["time"], timezone.utc):%Y-%m-%dT%H:%M:%S.%f}Z '
+            f'{AXIS_NAMES[row["axis"]]:3s} {KIND_NAMES[row["kind"]]:6s} {row["target"]}' for row in plan]
+
+
+def diff(old, new):
+    """ unified diff of the dumps of two plans """
+    return list(difflib.unified_diff(dump(old), dump(new), 'old', 'new', lineterm=''))
+
+
+def save(plan, day, directory=PLAN_DIR):
+    """ writes the plan, its metadata and its text dump """
+    import numpy as np
+    os.makedirs(directory, exist_ok=True)
+    np.save(planPath(day, 'npy', directory), plan)
+    with open(planPath(day, 'json', directory), 'w') as f:
+        json.dump({'day': f'{day:%Y-%m-%d}', 'config': configHash(), 'version': PLAN_VERSION,
+                   'created': datetime.now(timezone.utc).isoformat(), 'rows': len(plan)}, f, indent=2)
+    with open(planPath(day, 'txt', directory), 'w') as f:
+        f.write('\n'.join(dump(plan)) + '\n')
+
+
+def load(day, directory=PLAN_DIR):
+    """ saved plan of the day, None if there is none or it was built from another site configuration """
+    import numpy as np
+    try:
+        with open(planPath(day, 'json', directory)) as f:
+            meta = json.load(f)
+        if meta.get('config') != configHash():
+            return None
+        return np.load(planPath(day, 'npy', directory))
+    except (OSError, ValueError):
+        return None
+
+
+def getPlan(day, tz, observer=None, directory=PLAN_DIR):
+    """ saved plan of the day, built and saved first if it is missing or outdated """
+    plan = load(day, directory)
+    if plan is None:
+        plan = buildPlan(day, tz, observer)
+        save(plan, day, directory)
+    return plan
+
+
+def trackingIntervals(plan):
+    """ (start, end) unix timestamps of the sun tracking intervals of a plan, each starts at a SLEW row and ends at
+    the next HOME or ZENITH row (or after the last row), the rows from start up to end are SLEW and TRACK rows
+    """
+    intervals = []
+    start = None
+    for t, kind in zip(plan['time'].tolist(), plan['kind'].tolist()):
+        if kind == SLEW and start is None:
+            start = t
+        elif kind in (HOME, ZENITH) and start is not None:
+            intervals.append((start, t))
+            start = None
+    if start is not None:
+        intervals.append((start, float('inf')))
+    return intervals
+
+
+class PlanExecutor:
+    """ plays a plan back in real time
+
+    Args:
+        plan (numpy.ndarray): rows of PLAN_DTYPE
+        move (callable): move({axis: absolute step target}), moves the given axes at the same time
+        home (callable): home(), homes the RA axis
+        clock: object with time() and sleep(seconds), e.g. the time module
+    """
+
+    def __init__(self, plan, move, home, clock):
+        self.plan = plan
+        self.times = plan['time'].tolist()
+        self.axes = plan['axis'].tolist()
+        self.kinds = plan['kind'].tolist()
+        self.targets = plan['target'].tolist()
+        self.move = move
+        self.home = home
+        self.clock = clock
+        self.executed = 0
+        self.maxLateness = 0.0
+        # next row to execute, None until the first run
+        self.index = None
+
+    def catchUp(self, index):
+        """ brings the axes to where the plan has them just before row index """
+        pending = {}
+        homeLast = False
+        for i in range(index):
+            if self.kinds[i] == HOME:
+                homeLast = True
+                pending.pop(RA_AXIS, None)
+            else:
+                pending[self.axes[i]] = self.targets[i]
+                homeLast = homeLast and self.axes[i] != RA_AXIS
+        if homeLast:
+            self.home()
+        if pending:
+            self.move(pending)
+
+    def run(self, until=None):
+        """ executes the rows from now on, returns after the last row or at the unix timestamp until.
+        The first run catches up with the rows before now, a later run continues with the next row
+        """
+        if self.index is None:
+            self.index = bisect.bisect_left(self.times, self.clock.time())
+            self.catchUp(self.index)
+        i = self.index
+        while i < len(self.times):
+            t = self.times[i]
+            if until is not None and t >= until:
+                self.clock.sleep(max(0, until - self.clock.time()))
+                break
+            now = self.clock.time()
+            if now < t:
+                self.clock.sleep(t - now)
+            self.maxLateness = max(self.maxLateness, self.clock.time() - t)
+            # rows at the same time are executed together, both axes in one move
+            pending = {}
+            while i < len(self.times) and self.times[i] == t:
+                if self.kinds[i] == HOME:
+                    if pending:
+                        self.move(pending)
+                        pending = {}
+                    self.home()
+                else:
+                    pending[self.axes[i]] = self.targets[i]
+                self.executed += 1
+                i += 1
+            if pending:
+                self.move(pending)
+        self.index = i
+
+
+if __name__ == '__main__':
+    import sys
+    import pytz
+    import numpy as np
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    tz = pytz.timezone('Europe/Berlin')
+    day = datetime.strptime(args[0], '%Y-%m-%d').date() if args else datetime.now(tz).date()
+    if '--rebuild' in sys.argv:
+        plan = buildPlan(day, tz)
+        save(plan, day)
+    else:
+        plan = getPlan(day, tz)
+    print(f'{len(plan)} rows, config {configHash()}, written to {planPath(day, "npy")}')
+    if '--dump' in sys.argv:
+        print('\n'.join(dump(plan)))
+    if '--diff' in sys.argv:
+        print('\n'.join(diff(np.load(sys.argv[sys.argv.index('--diff') + 1]), plan)))
@@ -0,0 +1,63 @@
+"""
+Integer step-domain position model
+
+The position of the antenna is the absolute step count of each axis, nothing else is
+accumulated. Angles are derived from it only where they are needed, with the exact
+rational scale STEPS_PER_ROT / 360 steps per degree, so no rounding error builds up
+however many steps are made:
+    hour angle  = HOME_HA - (raSteps - HA_HOME_ABS_POSITION) / STEPS_PER_DEG
+    RA          = local sidereal time - hour angle
+    Dec         = HOME_DEC + (decSteps - DEC_HOME_ABS_POSITION) / STEPS_PER_DEG
+The RA axis is fixed in hour angle while it does not move, so the RA follows from the
+sidereal time instead of being drifted at a fixed rate.
+"""
+
+from fractions import Fraction
+from constants import *
+from sidereal import localSiderealTime
+
+# Exact scale factor between degrees and (micro)steps
+STEPS_PER_DEG_EXACT = Fraction(STEPS_PER_ROT, 360)
+
+
+def degreesToSteps(degrees):
+    """ nearest whole number of steps for an angle in degrees, rounded once from the exact value """
+    return round(Fraction(degrees) * STEPS_PER_DEG_EXACT)
+
+
+def stepsToDegrees(steps):
+    """ angle in degrees of a whole number of steps, correctly rounded to a float """
+    return float(steps / STEPS_PER_DEG_EXACT)
+
+
+def raStepsToHourAngle(raSteps):
+    """ hour angle in degrees [0, 360) the RA axis points at """
+    return (HOME_HA - stepsToDegrees(raSteps - HA_HOME_ABS_POSITION))%360
+
+
+def raStepsToRa(raSteps, ts):
+    """ RA in degrees [0, 360) the RA axis points at, at the unix timestamp ts """
+    return (localSiderealTime(ts) - raStepsToHourAngle(raSteps))%360
+
+
+def decStepsToDec(decSteps):
+    """ declination in degrees the Dec axis points at """
+    return HOME_DEC + stepsToDegrees(decSteps - DEC_HOME_ABS_POSITION)
+
+
+def hourAngleToRaSteps(ha, near):
+    """ absolute RA stepper position pointing at the hour angle ha, of the positions one turn apart the one
+    closest to near (e.g. the current position)
+    """
+    raSteps = HA_HOME_ABS_POSITION + degreesToSteps(HOME_HA - ha)
+    return raSteps + round((near - raSteps) / STEPS_PER_ROT) * STEPS_PER_ROT
+
+
+def raToRaSteps(ra, ts, near):
+    """ absolute RA stepper position pointing at the RA ra at the unix timestamp ts, closest to near """
+    return hourAngleToRaSteps(localSiderealTime(ts) - ra, near)
+
+
+def decToDecSteps(dec):
+    """ absolute Dec stepper position pointing at the declination dec """
+    return DEC_HOME_ABS_POSITION + degreesToSteps(dec - HOME_DEC)
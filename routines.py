@@ -1,18 +1,33 @@
-import time
+import threading
+from fractions import Fraction
 from constants import *
-# https://github.com/Chr157i4n/TMC2209_Raspberry_Pi/tree/main
-try:
-    from src.TMC_2209.TMC_2209_StepperDriver import *
-    from src.TMC_2209._TMC_2209_GPIO_board import Board
-except ModuleNotFoundError:
-    from TMC_2209.TMC_2209_StepperDriver import *
-    from TMC_2209._TMC_2209_GPIO_board import Board
+from hardware import Loglevel, MovementAbsRel
+
+# Register settings written by setupTMC, in this order
+TMC_SETTINGS = [
+    ('set_direction_reg', (False,)),
+    ('set_current', (MAX_CURRENT, HOLD_CURRENT_MULTIPLIER, HOLD_CURRENT_DELAY)),
+    ('set_interpolation', (True,)),
+    ('set_spreadcycle', (False,)),
+    ('set_microstepping_resolution', (MICROSTEPS,)),
+    ('set_internal_rsense', (False,)),
+]
+
+class MoveInterrupted(KeyboardInterrupt):
+    """ a move was interrupted, steps are the steps at MICROSTEPS the drivers made before they stopped, an int for
+    moveStepper and a list in the order of the moves for moveSteppers
+    """
+
+    def __init__(self, steps):
+        super().__init__()
+        self.steps = steps
 
 def setupTMC(tmc):
-    """ initializes the settings in the register of the TMC driver
+    """ initializes the settings in the register of the TMC driver. The driver is enabled by the first move
 
     Args:
-        tmc (TMC_2209): TMC object from the TMC_2209 stepper driver library
+        tmc (TMC_2209): TMC object from the TMC_2209 stepper driver library, a driver created by a hardware backend
+            or a session.DriverSession, which skips the settings already written
     """
     # set the loglevel of the libary (currently only printed)
     # set whether the movement should be relative or absolute
@@ -21,27 +36,135 @@ def setupTMC(tmc):
     tmc.set_movement_abs_rel(MovementAbsRel.ABSOLUTE)
 
     # these functions change settings in the TMC register
-    tmc.set_direction_reg(False)
-    tmc.set_current(MAX_CURRENT)
-    tmc.set_interpolation(True)
-    tmc.set_spreadcycle(False)
-    tmc.set_microstepping_resolution(MICROSTEPS)
-    tmc.set_internal_rsense(False)
-    tmc.set_motor_enabled(True)
+    for setter, args in TMC_SETTINGS:
+        getattr(tmc, setter)(*args)
 
     tmc.set_acceleration_fullstep(MAX_ACCEL)
-    tmc.set_max_speed_fullstep(MAX_SPEED)
+    tmc.set_max_speed_fullstep(fullstepSpeed(MICROSTEPS))
+
+def fullstepSpeed(microsteps):
+    """ maximum speed in fullsteps/s at a microstepping resolution, MAX_SPEED unless the step pulses needed for it
+    exceed MAX_STEP_RATE
+    """
+    return min(MAX_SPEED, MAX_STEP_RATE / microsteps)
 
-def moveStepper(tmc, steps):
-    """ all the stepper movements are controlled here
+def setResolution(tmc, microsteps, speed=None):
+    """ switches the microstepping resolution of the driver and sets the speed and acceleration for it again, the
+    library keeps them in steps of the resolution they were set at. A session skips the register write when the
+    resolution does not change
 
     Args:
         tmc (TMC_2209): TMC driver object
-        steps (int): positive or negative value. steps, including microsteps, to move the stepper 
+        microsteps (int): microstepping resolution, a power of two
+        speed (float): maximum speed in fullsteps/s, fullstepSpeed(microsteps) if None
+    """
+    tmc.set_microstepping_resolution(microsteps)
+    tmc.set_max_speed_fullstep(speed if speed is not None else fullstepSpeed(microsteps))
+    tmc.set_acceleration_fullstep(MAX_ACCEL)
+
+def moveStepper(tmc, steps, microsteps=MICROSTEPS):
+    """ all the stepper movements are controlled here. The driver is disabled after the move unless a motion batch
+    of its session holds it enabled
+
+    Args:
+        tmc (TMC_2209): TMC driver object
+        steps (int): positive or negative value. steps at MICROSTEPS to move the stepper
+        microsteps (int): microstepping resolution the move runs at, not below MICROSTEPS
+
+    Returns:
+        int: steps at MICROSTEPS the driver made, fewer than steps if the move was stopped
+
+    Raises:
+        MoveInterrupted: on a KeyboardInterrupt, with the steps made until then
     """
+    # counted from the driver position, an interrupted move at a finer resolution ends on the nearest step
+    done = 0
     tmc.set_motor_enabled(True)
-    tmc.run_to_position_steps(steps, MovementAbsRel.RELATIVE)
-    cleanup(tmc)
+    try:
+        setResolution(tmc, microsteps)
+        start = tmc.get_current_position()
+        try:
+            if steps == 0:
+                pass
+            elif getattr(tmc, 'worker', None) is not None:
+                # step pulses from the worker process of the axis, see stepworker.py
+                tmc.worker.run(tmc, steps * microsteps // MICROSTEPS)
+            else:
+                tmc.run_to_position_steps(steps * microsteps // MICROSTEPS, MovementAbsRel.RELATIVE)
+        finally:
+            done = tmc.get_current_position() - start
+    except KeyboardInterrupt:
+        raise MoveInterrupted(round(Fraction(done * MICROSTEPS, microsteps))) from None
+    finally:
+        cleanup(tmc)
+    return round(Fraction(done * MICROSTEPS, microsteps))
+
+def moveSteppers(moves, microsteps=MICROSTEPS):
+    """ moves several steppers at the same time, each one in its own thread. Returns when the longest move is done
+
+    Args:
+        moves (list): (tmc, steps) pairs, see moveStepper
+        microsteps (int): microstepping resolution of the moves
+
+    Returns:
+        list: steps at MICROSTEPS each driver made, in the order of the moves
+
+    Raises:
+        MoveInterrupted: on a KeyboardInterrupt, with the steps made until all drivers stopped
+    """
+    moved = [0] * len(moves)
+
+    def move(index, tmc, steps):
+        try:
+            moved[index] = moveStepper(tmc, steps, microsteps)
+        except MoveInterrupted as interrupt:
+            moved[index] = interrupt.steps
+
+    threads = [threading.Thread(target=move, args=(index, tmc, steps)) for index, (tmc, steps) in enumerate(moves)
+               if steps != 0]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        # stop all axes before handing the interrupt on
+        for tmc, steps in moves:
+            tmc.stop()
+        for thread in threads:
+            thread.join()
+        raise MoveInterrupted(moved) from None
+    return moved
+
+def runToLimit(tmc, backend, pin, steps, timeout, microsteps=MICROSTEPS, speed=None):
+    """ moves the stepper as one continuous move until the limit sensor triggers. The move is stopped from the
+    GPIO edge-detect callback of the sensor, or after timeout seconds. It is always stepped by the library, the
+    simulated limit sensor follows the simulated driver only
+
+    Args:
+        tmc (TMC_2209): TMC driver object
+        backend (TMC2209Backend or SimulatedBackend): hardware backend the limit sensor is read through
+        pin (int): limit sensor pin
+        steps (int): positive or negative maximum length of the move in steps at MICROSTEPS
+        timeout (float): maximum duration of the move in seconds
+        microsteps (int): microstepping resolution of the move
+        speed (float): maximum speed in fullsteps/s, see setResolution
+
+    Returns:
+        bool: whether the limit sensor triggered
+    """
+    backend.watchLimit(pin, lambda channel: tmc.stop())
+    timer = threading.Timer(timeout, tmc.stop)
+    timer.start()
+    try:
+        setResolution(tmc, microsteps, speed)
+        tmc.set_motor_enabled(True)
+        tmc.run_to_position_steps(steps * microsteps // MICROSTEPS, MovementAbsRel.RELATIVE)
+    finally:
+        timer.cancel()
+        backend.unwatchLimit(pin)
+        cleanup(tmc)
+    return not backend.readLimit(pin)
 
 def cleanup(tmc):
     """ pulls the enable pin high to disable the driver output. This is the only safe way to power off the motor. Sudden loss of power can damage the driver
@@ -0,0 +1,171 @@
+"""
+Raster and drift scans around the sun (or any source with at(t), see targets.py)
+
+A scan is precomputed into a trajectory, a structured array of SCAN_DTYPE rows, one per
+dwell: the time the move to it starts, the dwell start and end, the absolute step
+targets of both axes and the offsets of the antenna from the source in hour angle and
+declination (degrees). The move times come from slew.planSlew, so a scan that leaves
+the travel of the mount is refused before anything moves.
+
+    raster  grid of extent x extent degrees at spacing, the rows alternate direction so
+            there is no slew back to the start of a row. The antenna points at the
+            position of the source at the middle of each dwell of dwell seconds
+    drift   rows at declination offsets across extent at spacing. The antenna parks
+            extent/2 ahead of the source in hour angle and the source drifts through the
+            beam, a row lasts dwell seconds, by default the time the source needs to
+            drift across extent
+
+master.runScan executes a trajectory as batched moves at the planned times and writes
+every dwell with its planned and actual UTC times to a dwell log (SCAN_DIR/<kind>_<start>.csv)
+for matching against the CALLISTO spectra.
+
+usage: python scans.py raster|drift extent spacing [dwell] [--start YYYY-MM-DDTHH:MM]
+"""
+
+import os
+import csv
+from datetime import datetime, timezone
+from constants import *
+from position import hourAngleToRaSteps, decToDecSteps
+from slew import planSlew
+
+# Scan kinds
+RASTER = 'raster'
+DRIFT = 'drift'
+SCAN_KINDS = (RASTER, DRIFT)
+
+SCAN_DTYPE = [('move', '<f8'), ('start', '<f8'), ('end', '<f8'), ('ra', '<i8'), ('dec', '<i8'),
+              ('haOffset', '<f8'), ('decOffset', '<f8')]
+
+DWELL_FIELDS = ('index', 'plannedStart', 'plannedEnd', 'start', 'end', 'haOffset', 'decOffset', 'raSteps', 'decSteps')
+
+
+def offsets(extent, spacing):
+    """ offsets in degrees from -extent/2 to extent/2 at spacing, symmetric around 0 """
+    if spacing <= 0 or extent < 0:
+        raise ValueError(f'a scan needs a positive spacing and extent, got extent {extent}, spacing {spacing}')
+    half = int(extent / 2 / spacing + 1e-9)
+    return [i * spacing for i in range(-half, half + 1)]
+
+
+def hourAngleRate(source, t):
+    """ hour angle rate of the source at the unix timestamp t in degrees/s """
+    return ((source.at(t + 60).ha - source.at(t).ha + 180)%360 - 180) / 60
+
+
+def scanPoints(kind, source, start, extent, spacing, dwell):
+    """ (haOffset, decOffset, dwell seconds) of the dwells of a scan in the order they are observed """
+    if kind == RASTER:
+        if dwell is None:
+            raise ValueError('a raster scan needs a dwell time')
+        grid = offsets(extent, spacing)
+        return [(haOffset, decOffset, dwell) for row, decOffset in enumerate(grid)
+                for haOffset in (grid if row % 2 == 0 else grid[::-1])]
+    if kind == DRIFT:
+        if dwell is None:
+            dwell = extent / hourAngleRate(source, start)
+        return [(extent / 2, decOffset, dwell) for decOffset in offsets(extent, spacing)]
+    raise ValueError(f'unknown scan {kind!r}, expected {" or ".join(SCAN_KINDS)}')
+
+
+def buildTrajectory(kind, source, position, start, extent, spacing, dwell=None, maxSpeed=MAX_SPEED * MICROSTEPS,
+                    acceleration=MAX_ACCEL * MICROSTEPS):
+    """ precomputes a scan
+
+    Args:
+        kind (str): RASTER or DRIFT
+        source: object with at(t) returning a position with ha, dec and alt in degrees, e.g. ephemeris.SunEphemeris
+        position (list): absolute (RA, Dec) stepper positions the scan starts from
+        start (float): unix timestamp the first move starts at
+        extent (float): size of the scanned area in degrees
+        spacing (float): distance of the points (raster) or rows (drift) in degrees
+        dwell (float): seconds per point (raster) or row (drift), the drift time across extent if None for a drift
+        maxSpeed (float): speed of the slews in steps/s, see slew.planSlew
+        acceleration (float): acceleration of the slews in steps/s^2
+
+    Returns:
+        numpy.ndarray: rows of SCAN_DTYPE in the order of execution
+
+    Raises:
+        ValueError: the parameters make no scan or the source is below the horizon
+        slew.SlewLimitError: a point is outside the travel of the mount
+    """
+    import numpy as np
+    rows = []
+    t = start
+    current = list(position)
+    for haOffset, decOffset, length in scanPoints(kind, source, start, extent, spacing, dwell):
+        # the target follows from the time the dwell starts, which follows from the slew to the target
+        slewDuration = 0.0
+        for _ in range(2):
+            arrival = t + slewDuration
+            pointedAt = arrival + length / 2 if kind == RASTER else arrival
+            sourcePos = source.at(pointedAt)
+            if sourcePos.alt <= 0:
+                raise ValueError(f'the source is below the horizon at {datetime.fromtimestamp(pointedAt, timezone.utc)}')
+            slew = planSlew(current, hourAngleToRaSteps(sourcePos.ha + haOffset, current[0]),
+                            decToDecSteps(sourcePos.dec + decOffset), False, maxSpeed, acceleration)
+            slewDuration = slew.duration
+        rows.append((t, t + slewDuration, t + slewDuration + length, slew.raTarget, slew.decTarget, haOffset,
+                     decOffset))
+        current = [slew.raTarget, slew.decTarget]
+        t += slewDuration + length
+    return np.array(rows, dtype=SCAN_DTYPE)
+
+
+def isoTime(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def dump(trajectory):
+    """ one text line per dwell: UTC start and end, offsets and step targets """
+    return [f'{isoTime(row["start"])} - {isoTime(row["end"])} HA {row["haOffset"]:+8.3f} Dec {row["decOffset"]:+8.3f} '
+            f'RA {row["ra"]} DEC {row["dec"]}' for row in trajectory]
+
+
+def dwellLogPath(kind, start, directory=SCAN_DIR):
+    return os.path.join(directory, f'{kind}_{datetime.fromtimestamp(start, timezone.utc):%Y%m%d_%H%M%S}.csv')
+
+
+class DwellLog:
+    """ CSV log of the dwells of a scan, one row per dwell with its planned and actual UTC times
+
+    Args:
+        path (str): CSV file, its directory is created if missing
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(DWELL_FIELDS)
+        self.rows = 0
+
+    def record(self, index, row, start, end):
+        """ writes dwell index of the trajectory, observed from start to end (unix timestamps) """
+        self.writer.writerow((index, isoTime(row['start']), isoTime(row['end']), isoTime(start), isoTime(end),
+                              f'{row["haOffset"]:.4f}', f'{row["decOffset"]:.4f}', int(row['ra']), int(row['dec'])))
+        # on disk before the next move, a crash keeps the dwells observed so far
+        self.file.flush()
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+
+if __name__ == '__main__':
+    import sys
+    from ephemeris import SunEphemeris
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if '--start' in sys.argv:
+        start = datetime.strptime(sys.argv[sys.argv.index('--start') + 1], '%Y-%m-%dT%H:%M').astimezone()
+        args.remove(sys.argv[sys.argv.index('--start') + 1])
+    else:
+        start = datetime.now(timezone.utc)
+    kind, extent, spacing = args[0], float(args[1]), float(args[2])
+    dwell = float(args[3]) if len(args) > 3 else None
+    trajectory = buildTrajectory(kind, SunEphemeris(), [HA_HOME_ABS_POSITION, DEC_HOME_ABS_POSITION],
+                                 start.timestamp(), extent, spacing, dwell)
+    print('\n'.join(dump(trajectory)))
+    print(f'{len(trajectory)} dwells from home, {trajectory["end"][-1] - trajectory["move"][0]:.0f} s')
@@ -0,0 +1,126 @@
+"""
+Observation schedule as a sorted queue of events
+
+For every local day the queue holds the start and stop of the observing window,
+the start and end of every spectral overview (OVS) slot and sunrise/sunset.
+The control loop sleeps until the next event instead of polling the clock.
+"""
+
+import ephem
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from constants import *
+
+# Event kinds
+START = 'start'
+STOP = 'stop'
+OVS_START = 'ovs_start'
+OVS_END = 'ovs_end'
+SUNRISE = 'sunrise'
+SUNSET = 'sunset'
+
+# time is a timezone aware datetime
+Event = namedtuple('Event', ['time', 'kind'])
+
+
+def localTime(day, hour, minute, tz):
+    """ timezone aware datetime of a local wall clock time on the given day
+
+    Args:
+        day (date): local date
+        hour (int): hour 0..23
+        minute (int): minute 0..59
+        tz (pytz timezone): local timezone
+
+    Returns:
+        datetime: localized time
+    """
+    return tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+
+
+def sunEvents(day, tz, observer):
+    """ sunrise and sunset of the given local day, missing if the sun does not rise or set """
+    events = []
+    midnight = localTime(day, 0, 0, tz).astimezone(timezone.utc)
+    sun = ephem.Sun()
+    for kind, method in ((SUNRISE, observer.next_rising), (SUNSET, observer.next_setting)):
+        observer.date = midnight
+        try:
+            t = method(sun).datetime().replace(tzinfo=timezone.utc).astimezone(tz)
+        except (ephem.AlwaysUpError, ephem.NeverUpError):
+            continue
+        if t.date() == day:
+            events.append(Event(t, kind))
+    return events
+
+
+def dayEvents(day, tz, observer):
+    """ all events of one local day
+
+    Args:
+        day (date): local date
+        tz (pytz timezone): local timezone
+        observer (ephem.Observer): station observer, its date is changed
+
+    Returns:
+        list: Events sorted by time
+    """
+    events = [
+        Event(localTime(day, START_TIME_HOUR, START_TIME_MINUTE, tz) - timedelta(minutes=START_LEAD_MINUTES), START),
+        Event(localTime(day, STOP_TIME_HOUR, STOP_TIME_MINUTE, tz), STOP),
+    ]
+    for hour, minute in zip(OVS_TIMEH, OVS_TIMEM):
+        ovsTime = localTime(day, hour, minute, tz)
+        events.append(Event(ovsTime - timedelta(minutes=OVS_HALF_WINDOW), OVS_START))
+        events.append(Event(ovsTime + timedelta(minutes=OVS_HALF_WINDOW), OVS_END))
+    events += sunEvents(day, tz, observer)
+    return sorted(events)
+
+
+class Schedule:
+    """ event queue that is extended day by day as it is consumed """
+
+    def __init__(self, tz, observer):
+        self.tz = tz
+        self.observer = observer
+        self.events = []
+        self.lastDay = None
+
+    def extend(self):
+        """ appends the events of the day after lastDay to the queue """
+        self.lastDay += timedelta(days=1)
+        self.events += dayEvents(self.lastDay, self.tz, self.observer)
+
+    def next(self, now, kinds=None):
+        """ first event after now, events before now are dropped
+
+        Args:
+            now (datetime): timezone aware current time
+            kinds (tuple): only consider these event kinds, all if None
+
+        Returns:
+            Event: the next event
+        """
+        if self.lastDay is None or self.lastDay < now.astimezone(self.tz).date():
+            self.lastDay = now.astimezone(self.tz).date() - timedelta(days=1)
+            self.events = []
+        while True:
+            while self.events and self.events[0].time <= now:
+                self.events.pop(0)
+            for event in self.events:
+                if kinds is None or event.kind in kinds:
+                    return event
+            self.extend()
+
+    def inWindow(self, now, startKind, endKind):
+        """ whether now lies between the last startKind event and the following endKind event of its day """
+        events = dayEvents(now.astimezone(self.tz).date(), self.tz, self.observer)
+        inside = False
+        for event in events:
+            if event.time > now:
+                break
+            if event.kind == startKind:
+                inside = True
+            elif event.kind == endKind:
+                inside = False
+        return inside
@@ -0,0 +1,159 @@
+"""
+Driver sessions that keep the TMC2209 traffic down to the writes that change something
+
+A DriverSession wraps a driver created by a hardware backend and is used in its place.
+Register setters (UART writes on the TMC2209) are cached per register and skipped when
+the value is already written, so setupTMC on a restart of the menu or a repeated
+configuration costs nothing. The enable pin is cached the same way. Drivers on the same
+UART port share a lock, so register writes of the per-axis threads of routines.moveSteppers
+never interleave on the serial line.
+
+While a motion batch is open (hold()/release() or the batch() context manager) the
+driver stays enabled between moves and routines.cleanup does not disable it, the
+driver drops to its hold current (HOLD_CURRENT_MULTIPLIER of the run current) by
+itself once the motor stands still. The driver is disabled when the last batch ends.
+Every write that reaches the driver is counted in registerWrites, enableWrites and
+the ecallisto_driver_transactions_total metric, the time from enabling the driver to
+disabling it in the ecallisto_driver_enabled_seconds_total metric.
+
+A session with a stepworker.StepWorker attached as worker has its moves stepped by
+the worker process instead of the library, see routines.moveStepper.
+"""
+
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+from constants import *
+from metrics import DRIVER_TRANSACTIONS, DRIVER_ENABLED_SECONDS
+
+# Setters that write a TMC2209 register over UART
+REGISTER_SETTERS = ('set_direction_reg', 'set_current', 'set_interpolation', 'set_spreadcycle',
+                    'set_microstepping_resolution', 'set_internal_rsense')
+
+# One lock per UART port, shared by the sessions of the drivers on it
+uartLocks = {}
+uartLocksLock = threading.Lock()
+
+
+def uartLock(port):
+    """ the lock serializing the traffic on the UART port """
+    with uartLocksLock:
+        return uartLocks.setdefault(port, threading.Lock())
+
+
+class DriverSession:
+    """ caching proxy of a TMC driver, every other attribute is passed on to the driver
+
+    Args:
+        tmc (TMC_2209): driver created by a hardware backend
+        axis (str): axis name used in the metrics, 'ra' or 'dec'
+        port (str): UART port of the driver, register writes hold the lock of the port
+    """
+
+    def __init__(self, tmc, axis, port=RA_UART_PORT):
+        self.tmc = tmc
+        self.axis = axis
+        self.uart = uartLock(port)
+        self.registers = {}
+        self.enabled = None
+        # perf_counter() of the last enable, None while disabled
+        self.enabledSince = None
+        self.holds = 0
+        self.lock = threading.Lock()
+        # stepworker.StepWorker generating the step pulses of moveStepper, None for the library
+        self.worker = None
+        # statistics
+        self.registerWrites = 0
+        self.enableWrites = 0
+        self.skippedWrites = 0
+
+    def __getattr__(self, name):
+        if name in REGISTER_SETTERS:
+            return lambda *args, **kwargs: self.writeRegister(name, *args, **kwargs)
+        return getattr(self.tmc, name)
+
+    @property
+    def transactions(self):
+        """ writes that reached the driver, register writes and enable pin changes """
+        return self.registerWrites + self.enableWrites
+
+    def writeRegister(self, setter, *args, **kwargs):
+        """ calls the setter on the driver unless the same value was the last one written with it """
+        value = (args, tuple(sorted(kwargs.items())))
+        with self.lock:
+            if self.registers.get(setter) == value:
+                self.skippedWrites += 1
+                return
+            with self.uart:
+                getattr(self.tmc, setter)(*args, **kwargs)
+            self.registers[setter] = value
+            self.registerWrites += 1
+        DRIVER_TRANSACTIONS.labels(self.axis, 'register').inc()
+
+    def invalidate(self):
+        """ forgets the cached register values, e.g. after the driver lost power """
+        with self.lock:
+            self.registers.clear()
+            self.enabled = None
+
+    def set_motor_enabled(self, en):
+        """ switches the enable pin, disabling is deferred while a motion batch is open """
+        with self.lock:
+            if not en and self.holds:
+                self.skippedWrites += 1
+                return
+            if en == self.enabled:
+                self.skippedWrites += 1
+                return
+            self.tmc.set_motor_enabled(en)
+            self.enabled = en
+            self.enableWrites += 1
+            enabledFor = 0
+            if en:
+                self.enabledSince = perf_counter()
+            elif self.enabledSince is not None:
+                enabledFor = perf_counter() - self.enabledSince
+                self.enabledSince = None
+        DRIVER_TRANSACTIONS.labels(self.axis, 'enable').inc()
+        if enabledFor:
+            DRIVER_ENABLED_SECONDS.labels(self.axis).inc(enabledFor)
+
+    def stop(self, *args):
+        """ stops the move in progress, in the step worker and in the library """
+        if self.worker is not None:
+            self.worker.stop()
+        self.tmc.stop(*args)
+
+    def hold(self):
+        """ opens a motion batch, the driver stays enabled at hold current between the moves of the batch """
+        with self.lock:
+            self.holds += 1
+
+    def release(self):
+        """ closes a motion batch, the driver is disabled when the last one is closed """
+        with self.lock:
+            self.holds = max(self.holds - 1, 0)
+            if self.holds:
+                return
+        self.set_motor_enabled(False)
+
+    @contextmanager
+    def batch(self):
+        """ motion batch as a context manager, see hold() """
+        self.hold()
+        try:
+            yield self
+        finally:
+            self.release()
+
+
+@contextmanager
+def motionBatch(*sessions):
+    """ opens a motion batch on several driver sessions at once """
+    for session in sessions:
+        session.hold()
+    try:
+        yield sessions
+    finally:
+        for session in sessions:
+            session.release()
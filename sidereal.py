@@ -0,0 +1,101 @@
+"""
+Local sidereal time and hour angle without astropy
+
+Greenwich mean sidereal time follows Meeus (Astronomical Algorithms, eq. 12.4),
+the equation of the equinoxes uses the four largest nutation terms (Meeus ch. 22).
+UT1 is approximated by UTC, which dominates the difference to astropy
+(|UT1 - UTC| < 0.9 s, i.e. below SIDEREAL_TOLERANCE).
+
+All functions accept a scalar unix timestamp or a NumPy array of them. Scalars are
+computed with the math module, NumPy is only imported for arrays. Every call of
+localSiderealTime is timed in the ecallisto_sidereal_seconds metric.
+"""
+
+import math
+from constants import *
+from metrics import timed, SIDEREAL_SECONDS
+
+# Unix timestamp of the J2000.0 epoch (2000-01-01 12:00)
+J2000_UNIX = 946728000.0
+
+
+def meanSiderealTime(d, T):
+    """ Greenwich mean sidereal time in degrees, d days and T centuries since J2000 """
+    return 280.46061837 + 360.98564736629 * d + 0.000387933 * T * T - T * T * T / 38710000
+
+
+def equationOfEquinoxes(T, lib):
+    """ nutation in right ascension in degrees, T centuries since J2000 """
+    omega = lib.radians(125.04452 - 1934.136261 * T)
+    L = lib.radians(280.4665 + 36000.7698 * T)
+    Lm = lib.radians(218.3165 + 481267.8813 * T)
+    # nutation in longitude and obliquity in arcseconds
+    dPsi = -17.20 * lib.sin(omega) - 1.32 * lib.sin(2 * L) - 0.23 * lib.sin(2 * Lm) + 0.21 * lib.sin(2 * omega)
+    dEps = 9.20 * lib.cos(omega) + 0.57 * lib.cos(2 * L) + 0.10 * lib.cos(2 * Lm) - 0.09 * lib.cos(2 * omega)
+    eps = lib.radians(23.439291 - 0.0130042 * T + dEps / 3600)
+    return dPsi * lib.cos(eps) / 3600
+
+
+@timed(SIDEREAL_SECONDS)
+def localSiderealTime(ts, lon=LON):
+    """ local apparent sidereal time
+
+    Args:
+        ts (float or numpy.ndarray): unix timestamp(s)
+        lon (float): east longitude in degrees
+
+    Returns:
+        float or numpy.ndarray: local apparent sidereal time in degrees [0, 360)
+    """
+    if isinstance(ts, (int, float)):
+        lib = math
+    else:
+        import numpy as lib
+        ts = lib.asarray(ts, dtype=float)
+    d = (ts - J2000_UNIX) / 86400
+    T = d / 36525
+    return (meanSiderealTime(d, T) + equationOfEquinoxes(T, lib) + lon) % 360
+
+
+def hourAngle(ra, ts, lon=LON):
+    """ local hour angle of a given right ascension
+
+    Args:
+        ra (float or numpy.ndarray): right ascension in degrees
+        ts (float or numpy.ndarray): unix timestamp(s)
+        lon (float): east longitude in degrees
+
+    Returns:
+        float or numpy.ndarray: hour angle in degrees [0, 360)
+    """
+    return (localSiderealTime(ts, lon) - ra) % 360
+
+
+def validateAgainstAstropy(start=None, days=366, samples=1000, lon=LON):
+    """ compares localSiderealTime against astropy's apparent sidereal time (offline use only)
+
+    Args:
+        start (float): unix timestamp of the start of the checked interval, defaults to now
+        days (float): length of the checked interval
+        samples (int): number of random times to compare
+        lon (float): east longitude in degrees
+
+    Returns:
+        dict: maximum absolute difference in degrees and whether it is within SIDEREAL_TOLERANCE
+    """
+    import time
+    import numpy as np
+    import astropy.units as u
+    from astropy.time import Time
+
+    if start is None:
+        start = time.time()
+    ts = start + np.random.default_rng().uniform(0, days * 86400, samples)
+    reference = Time(ts, format='unix', scale='utc').sidereal_time('apparent', longitude=lon * u.deg).degree
+    diff = np.abs(localSiderealTime(ts, lon) - reference)
+    maxError = float(np.max(np.minimum(diff, 360 - diff)))
+    return {'max_error': maxError, 'ok': maxError <= SIDEREAL_TOLERANCE}
+
+
+if __name__ == '__main__':
+    print(validateAgainstAstropy())
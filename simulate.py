@@ -0,0 +1,159 @@
+"""
+Replays whole observing days on a virtual clock against the simulated driver
+
+master.py runs unchanged (trackSun with the schedule, the spectral overviews, homing
+and the waits) on a clock.VirtualClock from local midnight of the given date, so a
+day takes seconds. Moves take no simulated time. The pointing is sampled every
+--interval simulated seconds into a CSV log:
+
+    utc, local, sunHa, sunDec, sunAlt, antennaHa, antennaDec, raSteps, decSteps, error
+
+error is the antenna minus sun hour angle in degrees. An exception raised by the
+routines ends the replay early, it is reported in the summary. The replay runs in a scratch
+directory, so its journal, telemetry, plans and ephemeris cache never touch the
+station's files.
+
+usage: python simulate.py YYYY-MM-DD [--days N] [--mode poll|rate|plan] [--output pointing.csv]
+                          [--interval seconds] [--speed factor]
+"""
+
+import io
+import os
+import csv
+import time
+import argparse
+import tempfile
+import traceback
+import contextlib
+from datetime import datetime, timedelta, timezone
+from constants import *
+from clock import VirtualClock, ClockStopped
+from position import raStepsToHourAngle, decStepsToDec
+from scheduler import START, STOP, OVS_START, OVS_END
+
+LOG_FIELDS = ('utc', 'local', 'sunHa', 'sunDec', 'sunAlt', 'antennaHa', 'antennaDec', 'raSteps', 'decSteps', 'error')
+
+
+class PointingLog:
+    """ samples the pointing of master.py every interval simulated seconds while the routines sleep
+
+    The antenna stands still while a routine sleeps, so the samples over a sleep all use the step
+    positions at its start
+    """
+
+    def __init__(self, master, writer, start, interval):
+        self.master = master
+        self.writer = writer
+        self.interval = interval
+        self.next = start
+        self.rows = 0
+        # |error| of the samples in the observing window outside the spectral overviews while the sun is up
+        self.errors = []
+
+    def sample(self, now, seconds):
+        # a sample at the end of the sleep is taken after the routine acted on it, by the next sleep
+        while self.next < now + seconds:
+            self.write(self.next)
+            self.next += self.interval
+
+    def write(self, ts):
+        master = self.master
+        sunPos = master.sunEphemeris.at(ts)
+        raSteps, decSteps = master.absoluteStepperState
+        antennaHa = raStepsToHourAngle(raSteps)
+        error = (antennaHa - sunPos.ha + 180)%360 - 180
+        local = datetime.fromtimestamp(ts, master.tz)
+        self.writer.writerow((datetime.fromtimestamp(ts, timezone.utc).isoformat(), local.isoformat(),
+                              f'{sunPos.ha:.4f}', f'{sunPos.dec:.4f}', f'{sunPos.alt:.4f}', f'{antennaHa:.4f}',
+                              f'{decStepsToDec(decSteps):.4f}', raSteps, decSteps, f'{error:.4f}'))
+        self.rows += 1
+        if (sunPos.alt > 0 and master.schedule.inWindow(local, START, STOP)
+                and not master.schedule.inWindow(local, OVS_START, OVS_END)):
+            self.errors.append(abs(error))
+
+
+def simulate(day, days, mode, output, interval, speed=None):
+    """ replays days local days starting at day and writes the pointing log to output
+
+    Returns:
+        dict: summary of the replay
+    """
+    import master
+    # no metrics endpoint next to a running station
+    master.METRICS_PORT = None
+    master.TRACKING_MODE = mode
+    start = master.tz.localize(datetime.combine(day, datetime.min.time()))
+    end = master.tz.normalize(start + timedelta(days=days))
+    clock = VirtualClock(start.timestamp(), end.timestamp(), speed)
+
+    output = os.path.abspath(output)
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix='ecallisto_sim_'))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as console:
+            master.init('sim')
+        master.setClock(clock)
+        return replay(master, clock, start, end, output, interval, console)
+    finally:
+        os.chdir(cwd)
+
+
+def replay(master, clock, start, end, output, interval, console):
+    """ runs master.py on clock from start until the clock stops at end, see simulate """
+    wall = time.perf_counter()
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(LOG_FIELDS)
+        log = PointingLog(master, writer, clock.time(), interval)
+        clock.onSleep = log.sample
+        failure = None
+        with contextlib.redirect_stdout(console):
+            try:
+                master.home()
+                master.trackSun()
+            except ClockStopped:
+                pass
+            except Exception as e:
+                # the log up to the failure is the interesting part, the traceback goes to the console output
+                failure = f'{clock.now(master.tz)}: {type(e).__name__}: {e}'
+                traceback.print_exc(file=console)
+    wall = time.perf_counter() - wall
+    master.journal.close()
+    master.telemetry.close()
+
+    with open(output.rsplit('.', 1)[0] + '.console.txt', 'w') as f:
+        f.write(console.getvalue())
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'mode': master.TRACKING_MODE,
+        'simulated_s': clock.time() - start.timestamp(),
+        'wall_s': wall,
+        'speedup': (clock.time() - start.timestamp()) / wall,
+        'rows': log.rows,
+        'steps': master.tmc1.steps + master.tmc2.steps,
+        'mean_abs_error_deg': sum(log.errors) / len(log.errors) if log.errors else None,
+        'max_abs_error_deg': max(log.errors) if log.errors else None,
+        'failure': failure,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('date', help='first simulated local date (YYYY-MM-DD)')
+    parser.add_argument('--days', type=int, default=1, help='number of days to replay')
+    parser.add_argument('--mode', default=TRACKING_MODE, choices=('poll', 'rate', 'plan'), help='TRACKING_MODE')
+    parser.add_argument('--output', default=None, help='CSV pointing log, defaults to simulations/<date>_<mode>.csv')
+    parser.add_argument('--interval', type=float, default=60, help='simulated seconds between pointing samples')
+    parser.add_argument('--speed', type=float, default=None, help='multiple of real time, as fast as possible if omitted')
+    args = parser.parse_args()
+
+    output = args.output
+    if output is None:
+        os.makedirs('simulations', exist_ok=True)
+        output = os.path.join('simulations', f'{args.date}_{args.mode}.csv')
+    day = datetime.strptime(args.date, '%Y-%m-%d').date()
+    summary = simulate(day, args.days, args.mode, output, args.interval, args.speed)
+    for key, value in summary.items():
+        print(f'{key:20s} {value}')
+    print(f'pointing log written to {output}, console output to {output.rsplit(".", 1)[0]}.console.txt')
@@ -0,0 +1,91 @@
+"""
+Slew planning in absolute step space within the travel limits of the mount
+
+The RA axis can turn from the home sensor (RA_MAX_POSITION, at HA_HOME_ABS_POSITION,
+nothing beyond it) down to RA_MIN_POSITION, where the cable wrap ends. An RA target
+given as an absolute step position stands for all positions whole turns apart, the
+planner picks the legal one reached in the least time. Both axes move at the same
+time, so a slew takes as long as its longer axis (see hardware.moveDuration).
+
+A target outside the travel is refused with SlewLimitError, or with clip=True moved
+to the nearest end of the travel, which is what tracking wants: the antenna waits at
+the limit until the source comes into reach.
+"""
+
+from collections import namedtuple
+from constants import *
+from hardware import moveDuration
+
+# Relative moves of both axes, the absolute targets and the predicted duration in seconds
+Slew = namedtuple('Slew', 'raSteps decSteps raTarget decTarget duration clipped')
+
+
+class SlewLimitError(ValueError):
+    """ the target of a slew is outside the travel of the mount """
+
+
+def raCandidates(raTarget):
+    """ absolute RA positions pointing where raTarget points (whole turns apart) within the travel """
+    first = RA_MIN_POSITION + (raTarget - RA_MIN_POSITION) % STEPS_PER_ROT
+    return list(range(first, RA_MAX_POSITION + 1, STEPS_PER_ROT))
+
+
+def nearestRaLimit(raTarget):
+    """ end of the RA travel closest in angle to raTarget """
+    def distance(limit):
+        offset = (raTarget - limit) % STEPS_PER_ROT
+        return min(offset, STEPS_PER_ROT - offset)
+    return min((RA_MIN_POSITION, RA_MAX_POSITION), key=distance)
+
+
+def planSlew(position, raTarget=None, decTarget=None, clip=False, maxSpeed=MAX_SPEED * MICROSTEPS,
+             acceleration=MAX_ACCEL * MICROSTEPS):
+    """ minimum time legal slew to the given targets
+
+    Args:
+        position (list): current absolute (RA, Dec) stepper positions
+        raTarget (int): absolute RA position of any turn, None to keep the RA
+        decTarget (int): absolute Dec position, None to keep the Dec
+        clip (bool): move targets outside the travel to its nearest end instead of raising SlewLimitError
+        maxSpeed (float): maximum speed of the drivers in steps/s
+        acceleration (float): acceleration of the drivers in steps/s^2
+
+    Returns:
+        Slew: the moves of both axes and their predicted duration
+    """
+    raFrom, decFrom = position
+    clipped = False
+    if raTarget is None:
+        raTarget = raFrom
+    else:
+        candidates = raCandidates(raTarget)
+        if not candidates:
+            if not clip:
+                raise SlewLimitError(f'RA position {raTarget} is outside the travel '
+                                     f'{RA_MIN_POSITION}..{RA_MAX_POSITION} in every turn')
+            candidates = [nearestRaLimit(raTarget)]
+            clipped = True
+        raTarget = min(candidates, key=lambda candidate: (moveDuration(candidate - raFrom, maxSpeed, acceleration),
+                                                          abs(candidate - raFrom)))
+    if decTarget is None:
+        decTarget = decFrom
+    elif not DEC_MIN_POSITION <= decTarget <= DEC_MAX_POSITION:
+        if not clip:
+            raise SlewLimitError(f'Dec position {decTarget} is outside the travel {DEC_MIN_POSITION}..{DEC_MAX_POSITION}')
+        decTarget = min(max(decTarget, DEC_MIN_POSITION), DEC_MAX_POSITION)
+        clipped = True
+    raSteps = raTarget - raFrom
+    decSteps = decTarget - decFrom
+    duration = max(moveDuration(raSteps, maxSpeed, acceleration), moveDuration(decSteps, maxSpeed, acceleration))
+    return Slew(raSteps, decSteps, raTarget, decTarget, duration, clipped)
+
+
+def checkMove(position, raSteps, decSteps):
+    """ raises SlewLimitError if a relative move ends outside the travel, further out than it started.
+    Moves back into the travel (e.g. after a manual move past a limit) are allowed
+    """
+    for name, start, steps, low, high in (('RA', position[0], raSteps, RA_MIN_POSITION, RA_MAX_POSITION),
+                                          ('Dec', position[1], decSteps, DEC_MIN_POSITION, DEC_MAX_POSITION)):
+        end = start + steps
+        if (end > high and end > start) or (end < low and end < start):
+            raise SlewLimitError(f'{name} move of {steps} steps from {start} ends outside the travel {low}..{high}')
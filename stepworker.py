@@ -0,0 +1,247 @@
+"""
+Step pulse generation in a dedicated worker process
+
+The TMC_2209 library generates the step pulses in the calling thread, which shares
+the interpreter with the ephemeris, printing, the scheduler and the garbage collector.
+A StepWorker moves the pulse generation of one axis into its own process (started
+with spawn, so it inherits no threads or locks), optionally pinned to STEP_WORKER_CPU
+and run with SCHED_FIFO priority STEP_WORKER_PRIORITY (or the lowest nice value
+allowed when real-time scheduling is not permitted). The garbage collector is off
+in the worker.
+
+Moves are sent over a queue as (id, steps, maxSpeed, acceleration) and follow the
+trapezoidal profile of hardware.moveDuration, every step has a deadline on it. The
+worker sleeps until shortly before a deadline and busy-waits the last STEP_SPIN_TIME.
+Per move it reports the steps done, the lateness of the steps (mean, maximum and
+standard deviation as jitter) and the number of steps later than STEP_DEADLINE_TOLERANCE.
+A move is stopped early through a shared flag, e.g. from the limit sensor callback.
+
+The worker drives the step and dir pins through the GPIO module of the hardware
+backend, so it runs against the simulated GPIO on any Linux machine:
+
+usage: python stepworker.py [sim|tmc2209] [steps]
+"""
+
+import gc
+import os
+import sys
+import math
+import queue
+import signal
+import threading
+import multiprocessing
+from time import perf_counter, sleep
+from collections import namedtuple
+from constants import *
+from hardware import getBackend, moveDuration
+from metrics import STEP_LATENESS, STEP_DEADLINE_MISSES
+
+StepReport = namedtuple('StepReport', 'moveId requested steps duration missed meanLateness maxLateness jitter')
+
+
+def stepTime(n, steps, maxSpeed, acceleration):
+    """ time in seconds from the start of a move of steps steps at which step n (1..steps) is due
+
+    Accelerates at acceleration up to maxSpeed, cruises and decelerates again, see hardware.moveDuration
+    """
+    rampSteps = min(maxSpeed * maxSpeed / (2 * acceleration), steps / 2)
+    if n <= rampSteps:
+        return math.sqrt(2 * n / acceleration)
+    if n <= steps - rampSteps:
+        return math.sqrt(2 * rampSteps / acceleration) + (n - rampSteps) / maxSpeed
+    return moveDuration(steps, maxSpeed, acceleration) - math.sqrt(2 * (steps - n) / acceleration)
+
+
+def setRealtime(cpu, priority):
+    """ pins the calling process to cpu and raises its scheduling priority, returns what could not be done """
+    problems = []
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except (AttributeError, OSError) as e:
+            problems.append(f'affinity to CPU {cpu}: {e}')
+    if priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        except (AttributeError, OSError) as e:
+            problems.append(f'SCHED_FIFO priority {priority}: {e}')
+            try:
+                os.nice(-20)
+            except OSError:
+                pass
+    return problems
+
+
+def waitUntil(deadline):
+    """ sleeps until STEP_SPIN_TIME before the deadline and busy-waits the rest """
+    remaining = deadline - perf_counter() - STEP_SPIN_TIME
+    if remaining > 0:
+        sleep(remaining)
+    while perf_counter() < deadline:
+        pass
+
+
+def runMove(gpio, stepPin, dirPin, moveId, steps, maxSpeed, acceleration, stopFlag):
+    """ generates the step pulses of one move, runs in the worker process
+
+    Returns:
+        StepReport: steps done (signed) and the lateness statistics of the move
+    """
+    count = abs(steps)
+    gpio.output(dirPin, gpio.HIGH if steps > 0 else gpio.LOW)
+    done = 0
+    missed = 0
+    total = 0.0
+    totalSquares = 0.0
+    maxLateness = 0.0
+    start = perf_counter()
+    for n in range(1, count + 1):
+        if stopFlag.value:
+            break
+        deadline = start + stepTime(n, count, maxSpeed, acceleration)
+        waitUntil(deadline)
+        now = perf_counter()
+        gpio.output(stepPin, gpio.HIGH)
+        gpio.output(stepPin, gpio.LOW)
+        lateness = now - deadline
+        done += 1
+        total += lateness
+        totalSquares += lateness * lateness
+        maxLateness = max(maxLateness, lateness)
+        if lateness > STEP_DEADLINE_TOLERANCE:
+            missed += 1
+    mean = total / done if done else 0.0
+    jitter = math.sqrt(max(totalSquares / done - mean * mean, 0.0)) if done else 0.0
+    return StepReport(moveId, steps, done if steps > 0 else -done, perf_counter() - start, missed, mean, maxLateness,
+                      jitter)
+
+
+def workerMain(backendName, stepPin, dirPin, commands, results, stopFlag, cpu, priority):
+    """ entry point of the worker process """
+    # Ctrl+C reaches the whole process group, the parent stops the moves
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    problems = setRealtime(cpu, priority)
+    gpio = getBackend(backendName).gpio
+    gpio.setwarnings(False)
+    gpio.setmode(gpio.BCM)
+    gpio.setup(stepPin, gpio.OUT)
+    gpio.setup(dirPin, gpio.OUT)
+    results.put(problems)
+    gc.disable()
+    while True:
+        command = commands.get()
+        if command is None:
+            break
+        results.put(runMove(gpio, stepPin, dirPin, *command, stopFlag))
+        # collected between moves, never during one
+        gc.collect()
+
+
+class StepWorker:
+    """ step pulse worker process of one axis
+
+    Args:
+        backendName (str): hardware backend whose GPIO module the worker drives, see hardware.getBackend
+        stepPin (int): step pin (BCM numbering)
+        dirPin (int): direction pin (BCM numbering)
+        axis (str): axis name used in the metrics, 'ra' or 'dec'
+        cpu (int): CPU the worker is pinned to, None for no affinity
+        priority (int): SCHED_FIFO priority of the worker, None to keep the normal scheduling
+    """
+
+    def __init__(self, backendName, stepPin, dirPin, axis, cpu=STEP_WORKER_CPU, priority=STEP_WORKER_PRIORITY):
+        context = multiprocessing.get_context('spawn')
+        self.axis = axis
+        self.commands = context.Queue()
+        self.results = context.Queue()
+        # checked before every step, a raw shared byte needs no lock
+        self.stopFlag = context.RawValue('b', 0)
+        self.lock = threading.Lock()
+        self.nextId = 0
+        # statistics over all moves
+        self.moves = 0
+        self.steps = 0
+        self.missed = 0
+        self.maxLateness = 0.0
+        self.lastReport = None
+        self.process = context.Process(target=workerMain, name=f'step-{axis}', daemon=True,
+                                       args=(backendName, stepPin, dirPin, self.commands, self.results, self.stopFlag,
+                                             cpu, priority))
+        self.process.start()
+        for problem in self.results.get(timeout=STEP_WORKER_TIMEOUT):
+            print(f'step worker {axis}: could not set {problem}')
+
+    def move(self, steps, maxSpeed, acceleration):
+        """ runs a relative move in the worker and waits for it
+
+        Args:
+            steps (int): positive or negative number of (micro)steps
+            maxSpeed (float): maximum speed in steps/s
+            acceleration (float): acceleration in steps/s^2
+
+        Returns:
+            StepReport: the report of the move
+        """
+        with self.lock:
+            self.nextId += 1
+            self.stopFlag.value = 0
+            self.commands.put((self.nextId, steps, maxSpeed, acceleration))
+            timeout = moveDuration(steps, maxSpeed, acceleration) + STEP_WORKER_TIMEOUT
+            try:
+                report = self.results.get(timeout=timeout)
+            except KeyboardInterrupt:
+                # the move is stopped and its report collected, so the next move gets its own
+                self.stop()
+                report = self.results.get(timeout=STEP_WORKER_TIMEOUT)
+                self.account(report)
+                raise
+            except queue.Empty:
+                raise RuntimeError(f'step worker {self.axis} did not finish a move within {timeout:.1f} s')
+            self.account(report)
+            return report
+
+    def account(self, report):
+        self.lastReport = report
+        self.moves += 1
+        self.steps += abs(report.steps)
+        self.missed += report.missed
+        self.maxLateness = max(self.maxLateness, report.maxLateness)
+        if report.steps:
+            STEP_LATENESS.labels(self.axis).observe(report.maxLateness)
+        STEP_DEADLINE_MISSES.labels(self.axis).inc(report.missed)
+
+    def run(self, tmc, steps):
+        """ moves the driver tmc by steps with its configured speed and acceleration, keeps its position up to date
+
+        Returns:
+            StepReport: the report of the move
+        """
+        moves = self.moves
+        try:
+            self.move(steps, tmc.get_max_speed(), tmc.get_acceleration())
+        finally:
+            # also the steps of a move stopped by an interrupt
+            if self.moves > moves:
+                tmc.set_current_position(tmc.get_current_position() + self.lastReport.steps)
+        return self.lastReport
+
+    def stop(self):
+        """ stops the current move after the step in progress """
+        self.stopFlag.value = 1
+
+    def close(self):
+        self.commands.put(None)
+        self.process.join(STEP_WORKER_TIMEOUT)
+
+
+if __name__ == '__main__':
+    backendName = sys.argv[1] if len(sys.argv) > 1 else 'sim'
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    worker = StepWorker(backendName, stepPin, dirPin, 'ra')
+    for length in (1, steps, -steps):
+        report = worker.move(length, MAX_SPEED * MICROSTEPS, MAX_ACCEL * MICROSTEPS)
+        print(f'{report.steps:6d} steps in {report.duration:.3f} s (expected '
+              f'{moveDuration(length, MAX_SPEED * MICROSTEPS, MAX_ACCEL * MICROSTEPS):.3f} s), '
+              f'lateness mean {report.meanLateness * 1e6:.1f} us, max {report.maxLateness * 1e6:.1f} us, '
+              f'jitter {report.jitter * 1e6:.1f} us, {report.missed} missed deadlines')
+    worker.close()
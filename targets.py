@@ -0,0 +1,144 @@
+"""
+Pointing targets: the sun, solar system bodies and fixed J2000 sources
+
+Every target answers at(t) with a SunPosition (apparent RA, Dec, altitude and hour
+angle in degrees). RA and Dec come from a per-target cache that is refreshed only
+when the source has moved by more than one step of either axis since the last
+computation, the hour angle and altitude follow from the local sidereal time.
+Fixed sources are recomputed once per TARGET_CACHE_MAX_AGE (for precession,
+nutation and aberration), the sun every hour or so, the moon every few minutes.
+"""
+
+import math
+import ephem
+from constants import *
+from ephemeris import SunPosition, SunEphemeris, makeObserver, computeSun, toTimestamp
+from sidereal import localSiderealTime
+
+# Flux calibrators: name, J2000 RA and Dec in degrees
+CALIBRATORS = {
+    'casa': ('Cas A', 350.866, 58.812),
+    'cyga': ('Cyg A', 299.868, 40.734),
+    'taua': ('Tau A', 83.633, 22.0145),
+    'vira': ('Vir A', 187.706, 12.391),
+}
+
+
+def altitude(ha, dec, lat=LAT):
+    """ altitude in degrees of a source at the given hour angle and declination, without refraction """
+    ha, dec, lat = math.radians(ha), math.radians(dec), math.radians(lat)
+    return math.degrees(math.asin(math.sin(lat) * math.sin(dec) + math.cos(lat) * math.cos(dec) * math.cos(ha)))
+
+
+class Target:
+    """ base class, subclasses implement compute(ts) returning the apparent RA and Dec in degrees """
+
+    def __init__(self, name):
+        self.name = name
+        self.cached = None
+        self.cachedAt = math.inf
+        self.validUntil = -math.inf
+        self.refreshes = 0
+
+    def compute(self, ts):
+        raise NotImplementedError
+
+    def refresh(self, ts):
+        """ computes the position at ts and how long it stays within one step """
+        ra, dec = self.compute(ts)
+        laterRa, laterDec = self.compute(ts + TARGET_RATE_PROBE)
+        motion = max(abs((laterRa - ra + 180)%360 - 180), abs(laterDec - dec))
+        self.cached = (ra, dec)
+        self.cachedAt = ts
+        if motion > 0:
+            self.validUntil = ts + min(DEG_PER_STEP * TARGET_RATE_PROBE / motion, TARGET_CACHE_MAX_AGE)
+        else:
+            self.validUntil = ts + TARGET_CACHE_MAX_AGE
+        self.refreshes += 1
+
+    def at(self, t):
+        """ position of the target
+
+        Args:
+            t (datetime or float): time of the query
+
+        Returns:
+            SunPosition: RA, Dec, altitude and hour angle in degrees
+        """
+        ts = toTimestamp(t)
+        if not self.cachedAt <= ts < self.validUntil:
+            self.refresh(ts)
+        ra, dec = self.cached
+        ha = (localSiderealTime(ts) - ra)%360
+        return SunPosition(ra, dec, altitude(ha, dec), ha)
+
+
+class SunTarget(Target):
+    """ the sun, read from the interpolated daily ephemeris """
+
+    def __init__(self, sunEphemeris=None):
+        super().__init__('Sun')
+        self.sunEphemeris = sunEphemeris if sunEphemeris is not None else SunEphemeris()
+
+    def compute(self, ts):
+        position = self.sunEphemeris.at(ts)
+        return position.ra, position.dec
+
+
+class BodyTarget(Target):
+    """ a PyEphem body, e.g. ephem.Moon() """
+
+    def __init__(self, name, body):
+        super().__init__(name)
+        self.body = body
+        self.observer = makeObserver()
+
+    def compute(self, ts):
+        position = computeSun(self.observer, self.body, ts)
+        return position.ra, position.dec
+
+
+class FixedTarget(BodyTarget):
+    """ a source at fixed J2000 coordinates, precessed to the date by PyEphem """
+
+    def __init__(self, name, ra, dec):
+        body = ephem.FixedBody()
+        body._ra = math.radians(ra)
+        body._dec = math.radians(dec)
+        body._epoch = ephem.J2000
+        super().__init__(name, body)
+        self.j2000 = (ra, dec)
+
+
+class TargetRegistry:
+    """ creates targets by name and keeps one instance, and so one cache, per target """
+
+    def __init__(self, sunEphemeris=None):
+        self.sunEphemeris = sunEphemeris
+        self.targets = {}
+
+    def get(self, name):
+        """ target by name
+
+        Args:
+            name (str): 'sun', 'moon', a key of CALIBRATORS or 'RA,Dec' J2000 coordinates in degrees
+
+        Returns:
+            Target: the target
+        """
+        key = name.strip().lower().replace(' ', '')
+        if key not in self.targets:
+            if key == 'sun':
+                target = SunTarget(self.sunEphemeris)
+            elif key == 'moon':
+                target = BodyTarget('Moon', ephem.Moon())
+            elif key in CALIBRATORS:
+                target = FixedTarget(*CALIBRATORS[key])
+            else:
+                try:
+                    ra, dec = (float(value) for value in key.split(','))
+                except ValueError:
+                    raise ValueError(f'unknown target {name!r}, expected sun, moon, {", ".join(CALIBRATORS)} or RA,Dec')
+                target = FixedTarget(f'{ra % 360:g},{dec:g}', ra % 360, dec)
+            self.targets[key] = target
+        return self.targets[key]
@@ -0,0 +1,180 @@
+"""
+Binary telemetry log of the tracking state
+
+Records are fixed width rows of TELEMETRY_DTYPE appended to a memory-mapped file,
+one file per UTC day (telemetry_YYYYMMDD.bin in TELEMETRY_DIR). Files are
+preallocated for TELEMETRY_CAPACITY records and grown when full, unused rows
+have time 0. Writing a record is a copy into the mapping, the pages are flushed
+to disk every TELEMETRY_FLUSH_INTERVAL seconds, on rotation and on close.
+
+load() reads any time range back as one structured array without parsing text:
+    >>> import telemetry
+    >>> data = telemetry.load('2025-06-01', '2025-07-01')
+    >>> data['time'], data['lha'] - data['sunHa']
+"""
+
+import os
+import time
+from datetime import datetime, timezone
+from constants import *
+
+TELEMETRY_DTYPE = [
+    ('time', '<f8'),        # unix timestamp
+    ('sunRa', '<f8'),       # degrees
+    ('sunDec', '<f8'),
+    ('sunHa', '<f8'),
+    ('ra', '<f8'),          # antenna pointing, degrees
+    ('dec', '<f8'),
+    ('lha', '<f8'),
+    ('raSteps', '<i8'),     # absolute stepper state
+    ('decSteps', '<i8'),
+]
+
+
+def dayName(ts):
+    """ UTC date of a unix timestamp as YYYYMMDD """
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y%m%d')
+
+
+def dayPath(day, directory=TELEMETRY_DIR):
+    """ file holding the records of the given UTC day (YYYYMMDD) """
+    return os.path.join(directory, f'telemetry_{day}.bin')
+
+
+def openDay(path, mode='r'):
+    """ maps a day file and returns the mapping and the number of records in it
+
+    Returns:
+        tuple: (numpy.memmap, int), the mapping is None for an empty file
+    """
+    import numpy as np
+    if os.path.getsize(path) < np.dtype(TELEMETRY_DTYPE).itemsize:
+        return None, 0
+    records = np.memmap(path, dtype=TELEMETRY_DTYPE, mode=mode)
+    unused = np.flatnonzero(records['time'] == 0)
+    return records, int(unused[0]) if len(unused) else len(records)
+
+
+class TelemetryRecorder:
+    """ appends records to the memory-mapped file of the current UTC day """
+
+    def __init__(self, directory=TELEMETRY_DIR, capacity=TELEMETRY_CAPACITY, flushInterval=TELEMETRY_FLUSH_INTERVAL):
+        self.directory = directory
+        self.capacity = capacity
+        self.flushInterval = flushInterval
+        self.day = None
+        self.path = None
+        self.records = None
+        self.count = 0
+        self.lastFlush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def rotate(self, day):
+        """ closes the current file and maps the one of the given day, continuing after its last record """
+        import numpy as np
+        self.close()
+        self.day = day
+        self.path = dayPath(day, self.directory)
+        with open(self.path, 'ab') as f:
+            size = self.capacity * np.dtype(TELEMETRY_DTYPE).itemsize
+            if f.tell() < size:
+                f.truncate(size)
+        self.records, self.count = openDay(self.path, 'r+')
+
+    def grow(self):
+        """ doubles the size of the current file """
+        import numpy as np
+        self.records.flush()
+        self.records = None
+        with open(self.path, 'ab') as f:
+            f.truncate(2 * os.path.getsize(self.path))
+        self.records = np.memmap(self.path, dtype=TELEMETRY_DTYPE, mode='r+')
+
+    def record(self, t, sunRa, sunDec, sunHa, ra, dec, lha, raSteps, decSteps):
+        """ appends one record
+
+        Args:
+            t (float): unix timestamp, selects the daily file
+            sunRa, sunDec, sunHa (float): sun coordinates in degrees
+            ra, dec, lha (float): antenna pointing in degrees
+            raSteps, decSteps (int): absolute stepper state
+        """
+        day = dayName(t)
+        if day != self.day:
+            self.rotate(day)
+        if self.count == len(self.records):
+            self.grow()
+        self.records[self.count] = (t, sunRa, sunDec, sunHa, ra, dec, lha, raSteps, decSteps)
+        self.count += 1
+        if time.monotonic() - self.lastFlush >= self.flushInterval:
+            self.flush()
+
+    def flush(self):
+        if self.records is not None:
+            self.records.flush()
+        self.lastFlush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.records = None
+
+
+def toTimestamp(t):
+    """ unix timestamp of a timestamp, datetime (naive is UTC) or 'YYYY-MM-DD[ HH:MM:SS]' string in UTC """
+    if isinstance(t, str):
+        t = datetime.fromisoformat(t)
+    if isinstance(t, datetime):
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+        return t.timestamp()
+    return float(t)
+
+
+def load(start, end, directory=TELEMETRY_DIR):
+    """ reads all records with start <= time < end
+
+    Only the matching records of every daily file are copied out of its mapping.
+
+    Args:
+        start, end: unix timestamps, datetimes or ISO date strings (UTC)
+        directory (str): telemetry directory
+
+    Returns:
+        numpy.ndarray: records of TELEMETRY_DTYPE sorted by time
+    """
+    import numpy as np
+    start, end = toTimestamp(start), toTimestamp(end)
+    parts = []
+    day = datetime.fromtimestamp(start, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    while day.timestamp() < end:
+        path = dayPath(day.strftime('%Y%m%d'), directory)
+        if os.path.exists(path):
+            records, count = openDay(path)
+            if count:
+                times = records['time'][:count]
+                parts.append(np.array(records[:count][(times >= start) & (times < end)]))
+        day = datetime.fromtimestamp(day.timestamp() + 86400, timezone.utc)
+    if not parts:
+        return np.empty(0, dtype=TELEMETRY_DTYPE)
+    data = np.concatenate(parts)
+    return data[np.argsort(data['time'], kind='stable')]
+
+
+def days(directory=TELEMETRY_DIR):
+    """ UTC days (YYYYMMDD) with a telemetry file, sorted """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[len('telemetry_'):-len('.bin')] for name in os.listdir(directory)
+                  if name.startswith('telemetry_') and name.endswith('.bin'))
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) != 3:
+        print('usage: python telemetry.py START END    (UTC, e.g. 2025-06-21 2025-06-22)')
+        print('days:', ' '.join(days()))
+        sys.exit(1)
+    data = load(sys.argv[1], sys.argv[2])
+    print(f'{len(data)} records')
+    for row in data:
+        print(' '.join(str(value) for value in row))